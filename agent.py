@@ -0,0 +1,287 @@
+# Vault agent: keeps one unlocked PasswordManager in memory and serves
+# requests over a Unix domain socket, so scripts don't pay for loading the key
+# and the vault on every lookup.
+#
+#   python agent.py --config config.ini &
+#   python -c "import agent; print(agent.AgentClient('/path/to/agent.sock').get('github.com', 'alice'))"
+#
+# The protocol is newline-delimited JSON. A request is {"id": ..., "op": ..., ...}
+# and every response carries the id of its request, so a client can send many
+# requests without waiting (pipelining) and match the responses as they come.
+# Operations run on a thread pool: lookups share a read lock on the vault, changes
+# take the write lock, and so do searches, which build and sort the search
+# indexes of the in-memory store as needed. After idle_timeout seconds without requests the agent
+# locks itself, dropping the key, the entries and the plaintext cache, until it
+# receives an "unlock" request.
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from entries import RWLock, format_date
+
+
+class AgentError(Exception):
+    pass
+
+
+class Agent:
+    def __init__(self, config_file='config.ini', vault=None, socket_path=None, idle_timeout=None, workers=None):
+        self.config_file = config_file
+        self.vault_path = vault
+        self.vault = None
+        self.lock = RWLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4))
+        self.last_request = time.monotonic()
+        self.unlock()
+        config = self.vault.manager.config
+        self.socket_path = socket_path or config.agent_socket_path
+        self.idle_timeout = config.agent_idle_timeout if idle_timeout is None else idle_timeout
+
+    def unlock(self):
+        from cli import Vault
+        with self.lock.write():
+            if self.vault is None:
+                with contextlib.redirect_stdout(sys.stderr):
+                    vault = Vault(argparse.Namespace(config=self.config_file, vault=self.vault_path))
+                    vault.load()
+                    # Lookups run concurrently, so no entry may still need unwrapping on first read.
+                    for _ in vault.manager.unwrapped_entries():
+                        pass
+                self.vault = vault
+        return True
+
+    def lock_vault(self):
+        with self.lock.write():
+            if self.vault is not None:
+                self.vault.close()
+                self.vault = None
+        return True
+
+    def _manager(self):
+        if self.vault is None:
+            raise AgentError("The agent is locked")
+        return self.vault.manager
+
+    def handle(self, request):
+        # Runs on a worker thread.
+        op = request.get('op')
+        if op == 'ping':
+            return 'pong'
+        if op == 'unlock':
+            return self.unlock()
+        if op == 'lock':
+            return self.lock_vault()
+        if op in ('get', 'ls', 'stats'):
+            with self.lock.read():
+                manager = self._manager()
+                if op == 'get':
+                    return manager.get_password(request['website'], request['username'])
+                if op == 'stats':
+                    stats = {'entries': len(manager.passwords), 'cache': manager.cache.stats()}
+                    if metrics.enabled:
+                        stats['operations'] = metrics.registry.summary()
+                        stats['counters'] = metrics.registry.snapshot()['counters']
+                    return stats
+                if request.get('website'):
+                    entries, cursor = manager.passwords.for_website(request['website']), None
+                else:
+                    entries, cursor = manager.passwords.page(request.get('cursor'), request.get('limit') or manager.config.page_size)
+                return {'entries': [{'website': entry.website, 'username': entry.username,
+                                     'date_created': format_date(entry.created), 'date_modified': format_date(entry.modified)}
+                                    for entry in entries],
+                        'cursor': cursor}
+        if op == 'search':
+            with self.lock.write():
+                manager = self._manager()
+                results = manager.search(request.get('text'), request.get('mode') or 'substring', request.get('field'),
+                                         request.get('created'), request.get('modified'))
+                entries, cursor = results.page(request.get('cursor'), request.get('limit') or manager.config.page_size)
+                return {'entries': [{'website': entry.website, 'username': entry.username,
+                                     'date_created': format_date(entry.created), 'date_modified': format_date(entry.modified)}
+                                    for entry in entries],
+                        'cursor': cursor}
+        if op in ('add', 'rm'):
+            with self.lock.write():
+                manager = self._manager()
+                with contextlib.redirect_stdout(sys.stderr):
+                    if op == 'add':
+                        password = request.get('password') or manager.generate_password()
+                        manager.add_passwords([(request['website'], request['username'], password)])
+                        self.vault.save()
+                        return password
+                    if manager.passwords.get(request['website'], request['username']) is None:
+                        return False
+                    manager.delete_password(request['website'], request['username'])
+                    self.vault.save()
+                    return True
+        raise AgentError("Unknown operation: {}".format(op))
+
+    async def respond(self, request, writer, write_lock):
+        # Every request gets a response, whatever fails, or its client would wait until it times out.
+        loop = asyncio.get_running_loop()
+        request_id = None
+        try:
+            if not isinstance(request, dict):
+                raise AgentError("Requests must be JSON objects")
+            request_id = request.get('id')
+            response = {'id': request_id, 'ok': True, 'result': await loop.run_in_executor(self.executor, self.handle, request)}
+        except (AgentError, KeyError, ValueError, OSError) as e:
+            response = {'id': request_id, 'ok': False, 'error': str(e)}
+        except Exception as e:
+            from cryptography.fernet import InvalidToken
+            if isinstance(e, InvalidToken):
+                error = "Could not decrypt the password, it was encrypted with another master key"
+            else:
+                error = '{}: {}'.format(type(e).__name__, e)
+            response = {'id': request_id, 'ok': False, 'error': error}
+        async with write_lock:
+            writer.write((json.dumps(response) + '\n').encode())
+            await writer.drain()
+
+    async def serve_client(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.last_request = time.monotonic()
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = {'op': None}
+                # Every request gets its own task, later requests don't wait for earlier ones.
+                task = asyncio.create_task(self.respond(request, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def watch_idle(self):
+        while True:
+            await asyncio.sleep(min(1.0, self.idle_timeout))
+            if self.vault is not None and time.monotonic() - self.last_request > self.idle_timeout:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self.lock_vault)
+                print("Agent locked after {} idle seconds".format(self.idle_timeout), file=sys.stderr)
+
+    async def serve(self):
+        # Only the owner may reach the socket: its directory is 0700 and the socket 0600.
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.serve_client, path=self.socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        watcher = asyncio.create_task(self.watch_idle()) if self.idle_timeout > 0 else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher:
+                watcher.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.lock_vault()
+            self.executor.shutdown()
+
+
+class AgentClient:
+    # Small blocking client for the agent.
+    def __init__(self, socket_path, timeout=30):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socket_path)
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def pipeline(self, requests):
+        # Send every request, then collect the responses, returned in request order.
+        ids = []
+        for request in requests:
+            self.next_id += 1
+            ids.append(self.next_id)
+            self.file.write((json.dumps(dict(request, id=self.next_id)) + '\n').encode())
+        self.file.flush()
+        responses = {}
+        while len(responses) < len(ids):
+            line = self.file.readline()
+            if not line:
+                raise AgentError("The agent closed the connection")
+            response = json.loads(line)
+            responses[response['id']] = response
+        return [responses[i] for i in ids]
+
+    def request(self, op, **arguments):
+        response = self.pipeline([dict(arguments, op=op)])[0]
+        if not response['ok']:
+            raise AgentError(response['error'])
+        return response['result']
+
+    def get(self, website, username):
+        return self.request('get', website=website, username=username)
+
+    def get_many(self, keys):
+        # Passwords for many (website, username) pairs in one round trip, None where missing or failed.
+        responses = self.pipeline({'op': 'get', 'website': website, 'username': username} for website, username in keys)
+        return [response['result'] if response['ok'] else None for response in responses]
+
+    def add(self, website, username, password=None):
+        # Returns the stored password, which is generated when none is given.
+        return self.request('add', website=website, username=username, password=password)
+
+    def delete(self, website, username):
+        return self.request('rm', website=website, username=username)
+
+    def search(self, text=None, **arguments):
+        # One page of search results and the cursor of the next, see PasswordManager.search for the
+        # arguments, plus cursor and limit. Date ranges are [start, end] lists of epoch seconds.
+        response = self.request('search', text=text, **arguments)
+        return response['entries'], response['cursor']
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='agent', description="Serve the vault over a Unix domain socket")
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--vault', help="vault file, see cli.py")
+    parser.add_argument('--socket', help="socket path (default: agent_socket_path from the config)")
+    parser.add_argument('--idle-timeout', type=float, help="seconds without requests before locking, 0 disables")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--metrics', action='store_true', help="record operation timings, returned by the stats op")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    agent = Agent(args.config, args.vault, args.socket, args.idle_timeout, args.workers)
+    print("Agent listening on {}".format(agent.socket_path), file=sys.stderr)
+    try:
+        asyncio.run(agent.serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
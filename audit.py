@@ -0,0 +1,151 @@
+import os
+import hmac
+import mmap
+import hashlib
+
+from vaultfile import load_state, save_state
+
+
+class BreachList:
+    # Offline list of breached password hashes, searched with mmap and binary search
+    # so a corpus of tens of GB never has to be loaded.
+    # `path` is either one file of sorted `SHA1:COUNT` lines (full hashes, as in the
+    # ordered-by-hash HIBP download), or a directory of HIBP range files named
+    # after the 5 character hash prefix and holding sorted `SUFFIX:COUNT` lines.
+    def __init__(self, path):
+        self.path = path
+        self.ranges = os.path.isdir(path)
+        self.file = None
+        self.map = None
+        if not self.ranges:
+            self.file = open(path, 'rb')
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def signature(self):
+        # Changes whenever the list is replaced, so stored results can be invalidated.
+        stat = os.stat(self.path)
+        return [os.path.abspath(self.path), stat.st_size, stat.st_mtime]
+
+    def count(self, password):
+        # Number of times a password appears in the breach list, 0 when it does not.
+        digest = hashlib.sha1(password.encode()).hexdigest().upper().encode()
+        if not self.ranges:
+            return self._search(self.map, digest)
+        range_path = os.path.join(self.path, digest[:5].decode() + '.txt')
+        if not os.path.exists(range_path) or os.path.getsize(range_path) == 0:
+            return 0
+        with open(range_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as range_map:
+            return self._search(range_map, digest[5:])
+
+    @staticmethod
+    def _search(data, target):
+        # Binary search over sorted, variable-length lines: find the line around the
+        # middle byte, compare its hash and drop the half that cannot hold the target.
+        low, high = 0, len(data)
+        while low < high:
+            middle = (low + high) // 2
+            start = data.rfind(b'\n', 0, middle) + 1
+            end = data.find(b'\n', start)
+            if end == -1:
+                end = len(data)
+            found, _, count = data[start:end].rstrip(b'\r').partition(b':')
+            found = found.upper()
+            if found == target:
+                return int(count) if count.strip() else 1
+            if found < target:
+                low = end + 1
+            else:
+                high = start
+        return 0
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+
+def audit_key(key):
+    # Reuse is found by comparing keyed hashes of passwords, never the plaintext.
+    if isinstance(key, str):
+        key = key.encode()
+    return hmac.new(key, b'passmanager password audit', hashlib.sha256).digest()
+
+
+def token_id(ciphertext):
+    return hashlib.sha256(ciphertext.encode()).hexdigest()[:16]
+
+
+def print_progress(done, total):
+    print(f"Audited {done}/{total} entries", end='\r' if done < total else '\n')
+
+
+def audit_vault(manager, state_path, breach_list=None, progress=print_progress):
+    # Check the vault for reused and breached passwords. Only entries whose
+    # date_modified (or stored ciphertext) changed since the last audit are
+    # decrypted and rechecked, the rest reuse the results stored in `state_path`.
+    hash_key = audit_key(manager.key)
+    key_id = hmac.new(hash_key, b'key id', hashlib.sha256).hexdigest()[:16]
+    breaches = BreachList(breach_list) if breach_list else None
+    try:
+        signature = breaches.signature() if breaches else None
+        state = load_state(state_path)
+        if state.get('key_id') != key_id or state.get('breach_list') != signature:
+            # Another master key or breach list, every stored result is stale.
+            state = {}
+        previous = state.get('entries', {})
+        results = {}
+        total = len(manager.passwords)
+        done = 0
+        checked = 0
+        for batch in manager.batches():
+            stale = []
+            for entry in batch:
+                name = '{}\0{}'.format(entry.website, entry.username)
+                known = previous.get(name)
+                # The stored ciphertext is compared too, date_modified only has a resolution of one second.
+                if known and known['date_modified'] == entry.modified and known['token'] == token_id(entry.password):
+                    results[name] = known
+                else:
+                    stale.append(entry)
+            if stale:
+                unwrapped = manager.unwrap_many(stale)
+                decrypted = manager.decrypt_many(entry.password for entry in unwrapped)
+                for entry, password in zip(unwrapped, decrypted.values):
+                    if password is None:
+                        print(f"Error: Could not decrypt password for {entry.website} ({entry.username}).")
+                        continue
+                    results['{}\0{}'.format(entry.website, entry.username)] = {
+                        'date_modified': entry.modified,
+                        'token': token_id(entry.password),
+                        'digest': hmac.new(hash_key, password.encode(), hashlib.sha256).hexdigest(),
+                        'breach_count': breaches.count(password) if breaches else 0,
+                    }
+                    checked += 1
+            done += len(batch)
+            if progress:
+                progress(done, total)
+        save_state(state_path, {'key_id': key_id, 'breach_list': signature, 'entries': results})
+    finally:
+        if breaches:
+            breaches.close()
+
+    by_digest = {}
+    breached = []
+    for name, result in results.items():
+        website, username = name.split('\0', 1)
+        by_digest.setdefault(result['digest'], []).append((website, username))
+        if result['breach_count']:
+            breached.append({'website': website, 'username': username, 'count': result['breach_count']})
+    return {
+        'total': total,
+        'checked': checked,
+        'reused': [accounts for accounts in by_digest.values() if len(accounts) > 1],
+        'breached': breached,
+    }
@@ -0,0 +1,58 @@
+import os
+
+from masterkey import make_fernet
+
+
+class BatchResult:
+    # Ordered results of a batch operation. `values[i]` is None when item i
+    # failed, and `errors` maps that index to the exception raised for it.
+    def __init__(self, values, errors):
+        self.values = values
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def _run_chunk(operation, keys, values):
+    # Runs in a worker thread or process, so the Fernet instance is built from the keys.
+    # operation is 'encrypt', 'decrypt' or 'rotate', see masterkey.
+    fernet = make_fernet(keys)
+    method = getattr(fernet, operation)
+    results = []
+    for value in values:
+        try:
+            results.append((method(value.encode()).decode(), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def run_batch(operation, keys, values, workers=None, chunk_size=1000, executor='thread'):
+    # Encrypt, decrypt or re-encrypt `values` in chunks, fanned out over a thread or process pool.
+    # `keys` is one master key or a list of them, the newest first.
+    values = list(values)
+    workers = workers or os.cpu_count() or 1
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        chunk_results = [_run_chunk(operation, keys, chunk) for chunk in chunks]
+    else:
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+        pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        with pool_class(max_workers=min(workers, len(chunks))) as pool:
+            chunk_results = list(pool.map(_run_chunk, [operation] * len(chunks), [keys] * len(chunks), chunks))
+    results = []
+    errors = {}
+    for chunk in chunk_results:
+        for value, error in chunk:
+            if error is not None:
+                errors[len(results)] = error
+            results.append(value)
+    return BatchResult(results, errors)
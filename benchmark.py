@@ -0,0 +1,616 @@
+# Benchmarks for the password manager.
+# Run with: python benchmark.py [name ...]   (no names runs every benchmark)
+import io
+import os
+import sys
+import time
+import timeit
+import sqlite3
+import datetime
+import tempfile
+import contextlib
+import itertools
+import tracemalloc
+import json
+
+from entries import Entry, EntryStore, format_date
+from passmanager import PasswordManager
+import vaultfile
+import binvault
+
+
+def make_records(count, start=0):
+    # Build `count` fake entries spread across a handful of websites, as the records of a vault file.
+    return [{
+        'website': 'site{}.example.com'.format(i % 1000),
+        'username': 'user{}'.format(i),
+        'password': 'password{}'.format(i),
+        'date_created': format_date(start + i),
+        'date_modified': format_date(start + i),
+    } for i in range(count)]
+
+
+def make_entries(count):
+    # Build `count` fake entries spread across a handful of websites.
+    now = int(time.time())
+    return [Entry('site{}.example.com'.format(i % 1000), 'user{}'.format(i), 'password{}'.format(i), now, now)
+            for i in range(count)]
+
+
+def make_manager(directory, entries=(), **settings):
+    # PasswordManager rooted in `directory`, pre-filled with `entries`.
+    settings.setdefault('encryption', False)
+    config_file = os.path.join(directory, 'config.ini')
+    with open(config_file, 'w') as f:
+        f.write('[DEFAULT]\napp_file_path = {}\n'.format(directory))
+        for name, value in settings.items():
+            f.write('{} = {}\n'.format(name, value))
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = PasswordManager(config_file)
+    for entry in entries:
+        manager.passwords.add(entry)
+    return manager
+
+
+def bench_lookup(sizes=(1000, 10000, 100000, 200000), lookups=1000):
+    # Lookup latency of the indexed entry store against a linear list scan.
+    print("Lookup latency (per lookup)")
+    for size in sizes:
+        entries = make_entries(size)
+        store = EntryStore(entries)
+        keys = [(entries[i].website, entries[i].username) for i in range(size - 1, 0, -(size // lookups))]
+
+        def indexed():
+            for website, username in keys:
+                store.get(website, username)
+
+        def scan():
+            for website, username in keys[:10]:
+                for entry in entries:
+                    if entry.website == website and entry.username == username:
+                        break
+
+        indexed_time = min(timeit.repeat(indexed, number=1, repeat=5)) / len(keys)
+        scan_time = min(timeit.repeat(scan, number=1, repeat=3)) / 10
+        print("  {:>8} entries: indexed {:8.3f} us   list scan {:10.3f} us".format(size, indexed_time * 1e6, scan_time * 1e6))
+
+
+def bench_export(sizes=(1000, 10000, 100000)):
+    # Throughput of the bulk upsert export against the old one-commit-per-row insert loop.
+    print("Database export throughput")
+    for size in sizes:
+        entries = make_entries(size)
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, entries)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                manager.export_to_database()
+            bulk_time = time.perf_counter() - start
+            manager.conn.close()
+
+            # The per-row loop is capped, it takes minutes at larger sizes.
+            sample = entries[:min(size, 2000)]
+            conn = sqlite3.connect(os.path.join(directory, 'per_row.db'))
+            conn.execute("CREATE TABLE passwords (website TEXT, username TEXT, password TEXT, date_created DATE, date_modified DATE)")
+            start = time.perf_counter()
+            for entry in sample:
+                conn.execute("INSERT INTO passwords VALUES (?, ?, ?, ?, ?)", (entry.website, entry.username, entry.password, format_date(entry.created), format_date(entry.modified)))
+                conn.commit()
+            row_time = time.perf_counter() - start
+            conn.close()
+        print("  {:>8} entries: bulk {:10.0f} rows/s   per-row commit {:10.0f} rows/s".format(size, size / bulk_time, len(sample) / row_time))
+
+
+def bench_storage(sizes=(10000, 100000), lookups=1000):
+    # Open time and lookup latency of the SQLite storage backend.
+    print("SQLite storage backend")
+    for size in sizes:
+        entries = make_entries(size)
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, storage_backend='sqlite')
+            manager.passwords.add_many(entries)
+            manager.close()
+            start = time.perf_counter()
+            manager = make_manager(directory, storage_backend='sqlite')
+            open_time = time.perf_counter() - start
+            keys = [(entries[i].website, entries[i].username) for i in range(0, size, size // lookups)]
+            start = time.perf_counter()
+            for website, username in keys:
+                manager.get_password(website, username)
+            lookup_time = (time.perf_counter() - start) / len(keys)
+            manager.close()
+        print("  {:>8} entries: open {:8.2f} ms   lookup {:8.2f} us".format(size, open_time * 1e3, lookup_time * 1e6))
+
+
+def bench_lazy_load(sizes=(1000, 10000, 50000), reads=100):
+    # Opening an encrypted JSON vault with lazy decryption, then reading a few passwords twice.
+    print("Encrypted JSON vault open and read")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, encryption=True)
+            for entry in make_entries(size):
+                entry.password = manager.encrypt_password(entry.password)
+                manager.passwords.add(entry)
+            manager.save_to_file('bench.json')
+            manager.passwords.clear()
+            start = time.perf_counter()
+            manager.load_from_file('bench.json')
+            load_time = time.perf_counter() - start
+            # What the old eager load spent on decrypting every entry up front.
+            start = time.perf_counter()
+            for entry in manager.passwords:
+                manager.decrypt_password(entry.password)
+            eager_time = time.perf_counter() - start
+            keys = [(entry.website, entry.username) for entry in list(manager.passwords)[:reads]]
+            for _ in range(2):
+                for website, username in keys:
+                    manager.get_password(website, username)
+            stats = manager.cache.stats()
+        print("  {:>8} entries: load {:8.1f} ms (eager decrypt would add {:8.1f} ms)   cache hits {} misses {}   {:.1f} us/decrypt".format(
+            size, load_time * 1e3, eager_time * 1e3, stats['hits'], stats['misses'], stats['decrypt_time'] / stats['decrypts'] * 1e6))
+
+
+def bench_batch_crypto(size=100000):
+    # Encryption throughput of encrypt_many for different pool settings.
+    print("Batch encryption throughput ({} passwords)".format(size))
+    passwords = ['password{}'.format(i) for i in range(size)]
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, encryption=True)
+        start = time.perf_counter()
+        for password in passwords[:10000]:
+            manager.encrypt_password(password)
+        print("  one at a time         {:10.0f} passwords/s".format(10000 / (time.perf_counter() - start)))
+        workers = os.cpu_count() or 1
+        for executor, count in (('thread', 1), ('thread', workers), ('process', workers)):
+            manager.config.crypto_executor = executor
+            start = time.perf_counter()
+            manager.encrypt_many(passwords, workers=count)
+            print("  {:>7} x {:<3}         {:10.0f} passwords/s".format(executor, count, size / (time.perf_counter() - start)))
+
+
+def measure(function, *args):
+    # Wall time and peak traced memory above the starting point of one call.
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_vault_file(sizes=(10000, 100000, 1000000)):
+    # Streaming NDJSON save/load against the old json.dump/json.load layout.
+    print("Vault file save and load (wall time, peak memory)")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, make_entries(size))
+            legacy_path = os.path.join(directory, 'legacy.json')
+
+            def legacy_save():
+                copy = [entry.record() for entry in manager.passwords]
+                with open(legacy_path, 'w') as f:
+                    json.dump(copy, f, indent=4)
+
+            def legacy_load():
+                with open(legacy_path) as f:
+                    {(record['website'], record['username']): record for record in json.load(f)}
+
+            results = [
+                measure(manager.save_to_file, 'bench.ndjson'),
+                measure(legacy_save),
+            ]
+            manager.passwords.clear()
+            results += [
+                measure(manager.load_from_file, 'bench.ndjson'),
+                measure(legacy_load),
+            ]
+        print("  {:>8} entries: save {:6.2f} s {:8.1f} MB (json.dump {:6.2f} s {:8.1f} MB)   load {:6.2f} s {:8.1f} MB (json.load {:6.2f} s {:8.1f} MB)".format(
+            size, *[value for elapsed, peak in results for value in (elapsed, peak / 2 ** 20)]))
+
+
+def retained(function, *args):
+    # Traced memory still held by the result of one call.
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_memory(sizes=(100000, 1000000), days=30):
+    # Bytes per entry of the indexed store: Entry objects with epoch dates and interned strings against
+    # the old dicts of strings, both read from the same vault file lines. Then a date filter and sort on each.
+    print("Entry memory and date queries")
+    for size in sizes:
+        start = int(time.time()) - size
+        lines = [json.dumps(record) for record in make_records(size, start)]
+
+        def dicts():
+            records = (json.loads(line) for line in lines)
+            return {(record['website'], record['username']): record for record in records}
+
+        def entries():
+            return EntryStore(Entry.from_record(json.loads(line)) for line in lines)
+
+        dict_size = retained(dicts) / size
+        entry_size = retained(entries) / size
+        records = list(dicts().values())
+        store = list(entries())
+        cutoff = start + size - days * 86400
+        cutoff_text = format_date(cutoff)
+
+        def dict_filter():
+            # Dates had to be parsed to be compared as dates.
+            return [record for record in records
+                    if datetime.datetime.strptime(record['date_modified'], '%Y-%m-%d %H:%M:%S').timestamp() >= cutoff]
+
+        def entry_filter():
+            return [entry for entry in store if entry.modified >= cutoff]
+
+        assert len(dict_filter()) == len(entry_filter()) == len([r for r in records if r['date_modified'] >= cutoff_text])
+        dict_filter_time = min(timeit.repeat(dict_filter, number=1, repeat=3))
+        entry_filter_time = min(timeit.repeat(entry_filter, number=1, repeat=3))
+        dict_sort_time = min(timeit.repeat(lambda: sorted(records, key=lambda record: record['date_modified']), number=1, repeat=3))
+        entry_sort_time = min(timeit.repeat(lambda: sorted(store, key=lambda entry: entry.modified), number=1, repeat=3))
+        print("  {:>8} entries: {:6.0f} B/entry (dicts {:6.0f} B/entry)   filter {:8.1f} ms (dicts {:8.1f} ms)   sort {:8.1f} ms (dicts {:8.1f} ms)".format(
+            size, entry_size, dict_size, entry_filter_time * 1e3, dict_filter_time * 1e3, entry_sort_time * 1e3, dict_sort_time * 1e3))
+
+
+def bench_search(sizes=(100000, 1000000), limit=50, repeat=20):
+    # Latency of the first page of a search against a linear scan of the entries, and the cost of
+    # building the search index and of keeping it up to date.
+    from search import Query, SearchIndex
+    print("Search, first page of {} results".format(limit))
+    for size in sizes:
+        now = int(time.time())
+        entries = make_entries(size)
+        for i, entry in enumerate(entries):
+            entry.created = entry.modified = now - i * 60
+        store = EntryStore(entries)
+        start = time.perf_counter()
+        list(store.search(Query('site1', 'prefix')))
+        build_time = time.perf_counter() - start
+        # The trigram indexes are built on the first substring search.
+        start = time.perf_counter()
+        list(store.search(Query('site1')))
+        grams_time = time.perf_counter() - start
+
+        def full_index():
+            index = SearchIndex(entries)
+            for field in ('website', 'username'):
+                index._field_grams(field)
+            return index
+
+        index_size = retained(full_index) / size
+        queries = [
+            ('prefix', Query('site12', 'prefix'), lambda entry: entry.website.startswith('site12') or entry.username.startswith('site12')),
+            ('substring', Query('er1234'), lambda entry: 'er1234' in entry.website or 'er1234' in entry.username),
+            ('fuzzy', Query('usre12345', 'fuzzy', 'username'), None),
+            ('modified', Query(modified=(now - 30 * 86400, None)), lambda entry: entry.modified >= now - 30 * 86400),
+        ]
+        print("  {:>8} entries: index built in {:8.1f} ms, trigrams in {:8.1f} ms, {:6.0f} B/entry".format(
+            size, build_time * 1e3, grams_time * 1e3, index_size))
+        for name, query, scan in queries:
+            indexed_time = min(timeit.repeat(lambda: list(itertools.islice(store.search(query), limit)), number=1, repeat=repeat))
+            if scan is None:
+                # difflib over every username, as a search without the index would.
+                import difflib
+                usernames = [entry.username for entry in entries[:10000]]
+                scan_time = min(timeit.repeat(lambda: difflib.get_close_matches('usre12345', usernames, limit, 0.6), number=1, repeat=3)) * size / len(usernames)
+            else:
+                scan_time = min(timeit.repeat(lambda: [entry for entry in entries if scan(entry)][:limit], number=1, repeat=3))
+            print("    {:<10} {:10.3f} ms   (scan {:10.1f} ms)".format(name, indexed_time * 1e3, scan_time * 1e3))
+        extra = [Entry('new{}.example.org'.format(i), 'someone{}'.format(i), 'password', now, now) for i in range(1000)]
+        start = time.perf_counter()
+        for entry in extra:
+            store.add(entry)
+            entry.modified += 1
+            store.add(entry)
+            store.remove(entry.website, entry.username)
+        update_time = (time.perf_counter() - start) / len(extra)
+        print("    add, modify and delete {:8.1f} us per entry".format(update_time * 1e6))
+
+
+def bench_binary_vault(sizes=(10000, 100000), lookups=1000):
+    # Random lookups in a memory-mapped binary vault against loading the NDJSON vault first.
+    print("Binary vault lookups")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, encryption=True)
+            entries = make_entries(size)
+            result = manager.encrypt_many(entry.password for entry in entries)
+            for entry, password in zip(entries, result.values):
+                entry.password = password
+            manager.passwords.add_many(entries)
+            vault_path = os.path.join(directory, 'bench' + binvault.EXTENSION)
+            manager.export_to_binary(vault_path)
+            manager.save_to_file('bench.ndjson')
+            keys = [(entries[i].website, entries[i].username) for i in range(0, size, size // lookups)]
+
+            start = time.perf_counter()
+            manager.get_password_from_binary(vault_path, *keys[0])
+            cold_time = time.perf_counter() - start
+            with manager.open_binary(vault_path) as vault:
+                start = time.perf_counter()
+                for website, username in keys:
+                    manager.decrypt_password(vault.get(website, username).password)
+                lookup_time = (time.perf_counter() - start) / len(keys)
+            manager.passwords.clear()
+            start = time.perf_counter()
+            manager.load_from_file('bench.ndjson')
+            manager.get_password(*keys[0])
+            load_time = time.perf_counter() - start
+        print("  {:>8} entries: open+get {:8.3f} ms   get {:8.1f} us   (NDJSON load+get {:8.1f} ms)".format(
+            size, cold_time * 1e3, lookup_time * 1e6, load_time * 1e3))
+
+
+def bench_generator(count=100000, length=16):
+    # Passwords per second of generate_many against the old per-character random.choice loop.
+    import random
+    import string
+    import generator
+    print("Password generation ({} passwords of length {})".format(count, length))
+    chars = string.ascii_letters + string.digits + string.punctuation
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        ''.join(random.choice(chars) for _ in range(length))
+    print("  random.choice per character  {:10.0f} passwords/s".format(count // 10 / (time.perf_counter() - start)))
+    start = time.perf_counter()
+    generator.generate_many(count, generator.PasswordPolicy(length=length))
+    print("  generate_many                {:10.0f} passwords/s".format(count / (time.perf_counter() - start)))
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        generator.generate(generator.PasswordPolicy(length=length))
+    print("  generate, one at a time      {:10.0f} passwords/s".format(count // 10 / (time.perf_counter() - start)))
+
+
+def bench_sync(sizes=(10000, 100000), changes=10):
+    # Saving and exporting a vault after a few changes: delta sync against a full rewrite.
+    print("Sync after {} changes".format(changes))
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, make_entries(size))
+            db_path = os.path.join(directory, 'bench.db')
+            sqlite3.connect(db_path).close()
+            with contextlib.redirect_stdout(io.StringIO()):
+                manager.save_to_file('bench.ndjson')
+                manager.export_to_database(db_path)
+                for i in range(changes):
+                    manager.modify_password('site{}.example.com'.format(i % 1000), 'user{}'.format(i), 'changed')
+                manager.delete_password('site999.example.com', 'user999')
+                save_time = measure(manager.save_to_file, 'bench.ndjson')[0]
+                export_time = measure(manager.export_to_database, db_path)[0]
+                full_save_time = measure(vaultfile.write_records, os.path.join(directory, 'full.ndjson'), manager.passwords)[0]
+                manager.changes.synced.clear()
+                full_export_time = measure(manager.export_to_database, db_path)[0]
+        print("  {:>8} entries: save {:8.2f} ms (full {:8.2f} ms)   export {:8.2f} ms (full {:8.2f} ms)".format(
+            size, save_time * 1e3, full_save_time * 1e3, export_time * 1e3, full_export_time * 1e3))
+
+
+def bench_rotation(sizes=(10000, 100000)):
+    # Key rotation of a database and an NDJSON vault file: wall time and peak memory, which stays bounded by the chunk size.
+    print("Master key rotation (wall time, peak memory)")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            manager = make_manager(directory, encryption=True)
+            entries = make_entries(size)
+            result = manager.encrypt_many(entry.password for entry in entries)
+            for entry, password in zip(entries, result.values):
+                entry.password = password
+            manager.passwords.add_many(entries)
+            db_path = os.path.join(directory, 'bench.db')
+            sqlite3.connect(db_path).close()
+            file_path = os.path.join(directory, 'bench.ndjson')
+            with contextlib.redirect_stdout(io.StringIO()):
+                manager.export_to_database(db_path)
+                manager.save_to_file(file_path)
+            manager.passwords.clear()
+            del entries
+            results = [
+                measure(manager.rotate_key, [db_path], False, False),
+                measure(manager.rotate_key, [file_path], True, False),
+            ]
+        print("  {:>8} entries: database {:6.2f} s {:6.1f} MB   file {:6.2f} s {:6.1f} MB".format(
+            size, *[value for elapsed, peak in results for value in (elapsed, peak / 2 ** 20)]))
+
+
+def bench_cli_startup(runs=10, size=10000):
+    # Wall time of `cli.py get` in a fresh process, for each vault format, against an empty interpreter.
+    import subprocess
+    import statistics
+    print("CLI get, median of {} runs ({} entries)".format(runs, size))
+    cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+    def median_time(command):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    print("  {:<28} {:8.1f} ms".format('python -c pass', median_time([sys.executable, '-c', 'pass']) * 1e3))
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, encryption=True)
+        entries = make_entries(size)
+        result = manager.encrypt_many(entry.password for entry in entries)
+        for entry, password in zip(entries, result.values):
+            entry.password = password
+        manager.passwords.add_many(entries)
+        vaults = {
+            '.ndjson': os.path.join(directory, 'vault.ndjson'),
+            '.pmv': os.path.join(directory, 'vault.pmv'),
+            '.db': os.path.join(directory, 'vault.db'),
+        }
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.save_to_file(vaults['.ndjson'])
+            manager.export_to_binary(vaults['.pmv'])
+            manager.convert_vault(vaults['.pmv'], vaults['.db'])
+        website, username = entries[size // 2].website, entries[size // 2].username
+        config_file = os.path.join(directory, 'config.ini')
+        for name, path in vaults.items():
+            command = [sys.executable, cli_path, '--config', config_file, '--vault', path, 'get', website, username]
+            print("  {:<28} {:8.1f} ms".format('cli get ' + name, median_time(command) * 1e3))
+
+
+def bench_agent(size=10000, clients=(1, 8, 32), requests=2000, depth=16):
+    # Lookup throughput of a running agent: many client threads, each pipelining `depth` gets at a time.
+    import random
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+    from agent import AgentClient
+    print("Agent lookups ({} entries, pipeline depth {})".format(size, depth))
+    agent_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agent.py')
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, encryption=True)
+        entries = make_entries(size)
+        result = manager.encrypt_many(entry.password for entry in entries)
+        for entry, password in zip(entries, result.values):
+            entry.password = password
+        manager.passwords.add_many(entries)
+        vault = os.path.join(directory, 'vault.ndjson')
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.save_to_file(vault)
+        socket_path = os.path.join(directory, 'agent', 'agent.sock')
+        process = subprocess.Popen([sys.executable, agent_path, '--config', os.path.join(directory, 'config.ini'),
+                                    '--vault', vault, '--socket', socket_path, '--idle-timeout', '0'],
+                                   stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.05)
+            keys = [(entry.website, entry.username) for entry in entries]
+
+            def client(count):
+                with AgentClient(socket_path) as agent:
+                    for start in range(0, count, depth):
+                        agent.get_many(random.sample(keys, min(depth, count - start)))
+
+            for threads in clients:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(threads) as pool:
+                    list(pool.map(client, [requests // threads] * threads))
+                elapsed = time.perf_counter() - start
+                print("  {:>3} clients: {:10.0f} lookups/s".format(threads, requests // threads * threads / elapsed))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def bench_metrics(size=100000, lookups=100000):
+    # Per-call overhead of the metrics: none while disabled since nothing is wrapped, a
+    # timer and a histogram update per timed call while enabled.
+    import metrics
+    print("Metrics overhead (per call)")
+    with tempfile.TemporaryDirectory() as directory:
+        manager = make_manager(directory, make_entries(size))
+        keys = [('site{}.example.com'.format(i % 1000), 'user{}'.format(i)) for i in range(0, size, size // 1000)]
+        keys = keys * (lookups // len(keys))
+
+        def lookup():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for website, username in keys:
+                    manager.get_password(website, username)
+
+        disabled = min(timeit.repeat(lookup, number=1, repeat=5)) / len(keys)
+        counter = min(timeit.repeat(lambda: metrics.count('bench'), number=lookups, repeat=5)) / lookups
+        metrics.enable()
+        try:
+            enabled = min(timeit.repeat(lookup, number=1, repeat=5)) / len(keys)
+        finally:
+            metrics.disable()
+            metrics.registry.reset()
+        print("  get_password: disabled {:8.3f} us   enabled {:8.3f} us   (+{:.3f} us)".format(
+            disabled * 1e6, enabled * 1e6, (enabled - disabled) * 1e6))
+        print("  count() while disabled {:8.3f} us".format(counter * 1e6))
+
+
+# Per-operation timings of bench_regression are compared with those saved here by an earlier run.
+REGRESSION_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_metrics.json')
+
+
+def bench_regression(size=20000, repeat=3, tolerance=1.25, baseline_path=None):
+    # Run a fixed workload with metrics enabled and compare the mean time of every operation
+    # against the baseline, REGRESSION_BASELINE by default, flagging those slower than `tolerance`
+    # times. Without a baseline the timings of this run become it, delete the file to record a new one.
+    import metrics
+    baseline_path = baseline_path or os.environ.get('BENCHMARK_BASELINE') or REGRESSION_BASELINE
+    print("Regression check against {}".format(baseline_path))
+    metrics.registry.reset()
+    metrics.enable()
+    try:
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+                manager = make_manager(directory, encryption=True)
+                manager.add_passwords([(entry.website, entry.username, entry.password) for entry in make_entries(size)])
+                for i in range(0, size, size // 100):
+                    manager.get_password('site{}.example.com'.format(i % 1000), 'user{}'.format(i))
+                list(itertools.islice(manager.search('user12'), 50))
+                list(itertools.islice(manager.search('usre123', 'fuzzy'), 50))
+                file_path = os.path.join(directory, 'bench.ndjson')
+                db_path = os.path.join(directory, 'bench.db')
+                binary_path = os.path.join(directory, 'bench' + binvault.EXTENSION)
+                sqlite3.connect(db_path).close()
+                manager.save_to_file(file_path)
+                manager.export_to_database(db_path)
+                manager.export_to_binary(binary_path)
+                manager.get_password_from_binary(binary_path, 'site1.example.com', 'user1')
+                manager.passwords.clear()
+                manager.load_from_file(file_path)
+                manager.load_from_database(db_path)
+                # Not closed, which would save the metrics to the metrics_path of the temporary directory.
+                manager.load_from_binary(binary_path)
+        summary = metrics.registry.summary()
+    finally:
+        metrics.disable()
+        metrics.registry.reset()
+    if not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        print("  no baseline, saved the timings of {} operations".format(len(summary)))
+        return
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    regressions = 0
+    for name, timings in summary.items():
+        before = baseline.get(name)
+        if before is None or not before['mean']:
+            print("  {:<22} {:10.3f} ms   (new)".format(name, timings['mean'] * 1e3))
+            continue
+        ratio = timings['mean'] / before['mean']
+        flag = ''
+        if ratio > tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print("  {:<22} {:10.3f} ms   baseline {:10.3f} ms   x{:5.2f}{}".format(
+            name, timings['mean'] * 1e3, before['mean'] * 1e3, ratio, flag))
+    print("  {} of {} operations over x{}".format(regressions, len(summary), tolerance))
+
+
+BENCHMARKS = {
+    'lookup': bench_lookup,
+    'export': bench_export,
+    'storage': bench_storage,
+    'lazy_load': bench_lazy_load,
+    'batch_crypto': bench_batch_crypto,
+    'vault_file': bench_vault_file,
+    'memory': bench_memory,
+    'search': bench_search,
+    'sync': bench_sync,
+    'rotation': bench_rotation,
+    'binary_vault': bench_binary_vault,
+    'generator': bench_generator,
+    'cli_startup': bench_cli_startup,
+    'agent': bench_agent,
+    'metrics': bench_metrics,
+    'regression': bench_regression,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,145 @@
+import hmac
+import mmap
+import json
+import struct
+import hashlib
+import itertools
+
+import metrics
+from entries import Entry
+from vaultfile import atomic_open
+
+# Binary vault layout:
+#   magic | records | index | footer
+# Each record is a 4-byte length followed by the encrypted JSON of one entry.
+# The index is sorted and holds, per entry, a truncated keyed hash of
+# (website, username) and the big-endian offset of its record, so the index
+# sorts by hash first. The footer stores where the index starts and its length.
+# A lookup binary-searches the mmap'd index and decrypts a single record.
+MAGIC = b'PMVAULT\x01'
+EXTENSION = '.pmv'
+RECORD_LENGTH = struct.Struct('<I')
+DIGEST_SIZE = 16
+INDEX_ENTRY = struct.Struct('>{}sQ'.format(DIGEST_SIZE))
+FOOTER = struct.Struct('<QQ8s')
+CHUNK_SIZE = 1000
+
+
+def index_key(key):
+    # Hashes in the index are keyed, so they reveal nothing without the master key.
+    if isinstance(key, str):
+        key = key.encode()
+    return hmac.new(key, b'passmanager binary vault index', hashlib.sha256).digest()
+
+
+def key_digest(hash_key, website, username):
+    message = '{}\0{}'.format(website, username).encode()
+    return hmac.new(hash_key, message, hashlib.sha256).digest()[:DIGEST_SIZE]
+
+
+def write_vault(filepath, entries, hash_key, encrypt_many):
+    # Write entries to a binary vault that atomically replaces `filepath`.
+    # `encrypt_many` seals the records in batches, see PasswordManager.encrypt_many.
+    index = []
+    with atomic_open(filepath, 'wb') as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        entries = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries, CHUNK_SIZE))
+            if not chunk:
+                break
+            result = encrypt_many(json.dumps(entry.record()) for entry in chunk)
+            for entry, payload in zip(chunk, result.values):
+                if payload is None:
+                    print(f"Error: Could not encrypt record for {entry.website} ({entry.username}).")
+                    continue
+                payload = payload.encode()
+                index.append(INDEX_ENTRY.pack(key_digest(hash_key, entry.website, entry.username), offset))
+                f.write(RECORD_LENGTH.pack(len(payload)))
+                f.write(payload)
+                offset += RECORD_LENGTH.size + len(payload)
+        # Sorting the packed entries orders by hash, then offset. If a key was written
+        # more than once only its last record is indexed.
+        index.sort()
+        unique = [item for item, following in zip(index, index[1:] + [None])
+                  if following is None or following[:DIGEST_SIZE] != item[:DIGEST_SIZE]]
+        f.writelines(unique)
+        f.write(FOOTER.pack(offset, len(unique), MAGIC))
+        metrics.count('bytes.written', f.tell())
+    return len(unique)
+
+
+class BinaryVault:
+    # Read-only, memory-mapped view of a binary vault.
+    def __init__(self, filepath, hash_key, decrypt):
+        self.filepath = filepath
+        self.hash_key = hash_key
+        self.decrypt = decrypt
+        self.file = open(filepath, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("{} is not a binary vault".format(filepath))
+        if self.map[:len(MAGIC)] != MAGIC or len(self.map) < len(MAGIC) + FOOTER.size:
+            self.close()
+            raise ValueError("{} is not a binary vault".format(filepath))
+        self.index_offset, self.count, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{} is not a binary vault".format(filepath))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # Records in file order.
+        offset = len(MAGIC)
+        while offset < self.index_offset:
+            length, = RECORD_LENGTH.unpack_from(self.map, offset)
+            yield self._record(offset)
+            offset += RECORD_LENGTH.size + length
+
+    def _record(self, offset):
+        length, = RECORD_LENGTH.unpack_from(self.map, offset)
+        start = offset + RECORD_LENGTH.size
+        metrics.count('bytes.read', RECORD_LENGTH.size + length)
+        return Entry.from_record(json.loads(self.decrypt(self.map[start:start + length].decode())))
+
+    def _find(self, digest):
+        # Binary search over the fixed-size index entries.
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = self.index_offset + middle * INDEX_ENTRY.size
+            found = self.map[position:position + DIGEST_SIZE]
+            if found < digest:
+                low = middle + 1
+            elif found > digest:
+                high = middle
+            else:
+                return INDEX_ENTRY.unpack_from(self.map, position)[1]
+        return None
+
+    def get(self, website, username):
+        offset = self._find(key_digest(self.hash_key, website, username))
+        if offset is None:
+            return None
+        entry = self._record(offset)
+        # Guards against a truncated hash colliding with another key.
+        if entry.website != website or entry.username != username:
+            return None
+        return entry
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
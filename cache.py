@@ -0,0 +1,86 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class PlaintextCache:
+    # Size-bounded LRU cache of decrypted passwords with a time-to-live.
+    # Plaintext is held in bytearrays so it can be zeroed when it is evicted.
+    # Values are stored with the ciphertext they came from, a lookup with a
+    # different ciphertext is a miss, so a stale value is never returned.
+    # All methods are thread-safe.
+    def __init__(self, maxsize=1024, ttl=300):
+        self.lock = threading.RLock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decrypts = 0
+        self.decrypt_time = 0.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, ciphertext):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                token, plaintext, expires = item
+                if token == ciphertext and expires > time.monotonic():
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return plaintext.decode()
+                self.invalidate(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, ciphertext, plaintext):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.invalidate(key)
+            now = time.monotonic()
+            self.items[key] = (ciphertext, bytearray(plaintext.encode()), now + self.ttl)
+            # Drop expired values from the cold end, then enforce the size bound.
+            while self.items:
+                oldest = next(iter(self.items))
+                if len(self.items) <= self.maxsize and self.items[oldest][2] > now:
+                    break
+                self.invalidate(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None:
+                self._wipe(item[1])
+
+    def clear(self):
+        with self.lock:
+            for item in self.items.values():
+                self._wipe(item[1])
+            self.items.clear()
+
+    def record_decrypt(self, seconds):
+        with self.lock:
+            self.decrypts += 1
+            self.decrypt_time += seconds
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'decrypts': self.decrypts,
+            'decrypt_time': self.decrypt_time,
+        }
+
+    @staticmethod
+    def _wipe(buffer):
+        buffer[:] = bytes(len(buffer))
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+
+class ChangeTracker:
+    # Remembers which entries changed since the vault was last synced with each
+    # target (a vault file or database, by absolute path), so saves only write the delta.
+    # Every change gets the next version number and moves its key to the end of
+    # `changes`, so the keys changed since a version are a suffix of it and a
+    # delta costs as much as the changes it holds, not the size of the vault.
+    # Deleted entries are kept as tombstones, with their time of deletion, for
+    # targets that are written in full and may still hold them.
+    def __init__(self):
+        self.version = 0
+        self.changes = OrderedDict()
+        self.synced = {}
+        self.tombstones = {}
+
+    def touch(self, key):
+        # Record a new or modified entry.
+        self.tombstones.pop(key, None)
+        self._record(key, None)
+
+    def delete(self, key, date_deleted):
+        # Record a deleted entry.
+        self.tombstones[key] = date_deleted
+        self._record(key, date_deleted)
+
+    def _record(self, key, date_deleted):
+        self.version += 1
+        # With no synced target a later sync is a full write, so nothing needs remembering.
+        if self.synced:
+            self.changes[key] = (self.version, date_deleted)
+            self.changes.move_to_end(key)
+
+    def is_synced(self, target):
+        return self.synced.get(target) == self.version
+
+    def delta(self, target):
+        # Changes since `target` was last synced, as (changed keys, {deleted key: date deleted}),
+        # or None when it was never synced and needs a full write.
+        since = self.synced.get(target)
+        if since is None:
+            return None
+        changed = []
+        deleted = {}
+        for key in reversed(self.changes):
+            version, date_deleted = self.changes[key]
+            if version <= since:
+                break
+            if date_deleted is None:
+                changed.append(key)
+            else:
+                deleted[key] = date_deleted
+        changed.reverse()
+        return changed, deleted
+
+    def date_deleted(self, key):
+        # When the entry with this key was deleted, None unless it is.
+        return self.tombstones.get(key)
+
+    def deleted(self):
+        # Every tombstone, as {key: date deleted}.
+        return dict(self.tombstones)
+
+    def mark_synced(self, target, version=None):
+        # `target` now holds every change up to `version`, the current one by default.
+        self.synced[target] = self.version if version is None else version
+        # Changes every target has seen are dropped.
+        oldest = min(self.synced.values())
+        while self.changes:
+            key, (version, date_deleted) = next(iter(self.changes.items()))
+            if version > oldest:
+                break
+            del self.changes[key]
@@ -0,0 +1,356 @@
+# Non-interactive command line interface, for scripts.
+# Every command prints JSON (one object per line) on stdout; messages from the
+# password manager itself go to stderr so they never mix with the output.
+#
+#   python cli.py get github.com alice
+#   python cli.py add github.com alice --generate
+#   printf 'website,username,password\nexample.com,bob,\n' | python cli.py batch --format csv
+#   python cli.py --metrics get github.com alice && python cli.py stats --prometheus
+import os
+import sys
+import json
+import argparse
+import contextlib
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='passmanager', description="Scriptable password manager")
+    parser.add_argument('--config', default='config.ini', help="config file (default: config.ini)")
+    parser.add_argument('--vault', help="vault file, .ndjson, .pmv or .db (default: vault.ndjson in save_password_dir)")
+    parser.add_argument('--metrics', action='store_true', help="record operation timings and counters to metrics_path")
+    parser.add_argument('--profile', metavar='FILE', help="write a cProfile capture of the command to FILE")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="add or update an entry")
+    add.add_argument('website')
+    add.add_argument('username')
+    source = add.add_mutually_exclusive_group(required=True)
+    source.add_argument('--password', help="password to store")
+    source.add_argument('--stdin', action='store_true', help="read the password from the first line of stdin")
+    source.add_argument('--generate', action='store_true', help="generate a password")
+
+    get = commands.add_parser('get', help="print the password of an entry")
+    get.add_argument('website')
+    get.add_argument('username')
+    get.add_argument('--raw', action='store_true', help="print only the password")
+
+    rm = commands.add_parser('rm', help="delete an entry")
+    rm.add_argument('website')
+    rm.add_argument('username')
+
+    ls = commands.add_parser('ls', help="list entries, without passwords")
+    ls.add_argument('--website', help="only list entries for this website")
+    ls.add_argument('--limit', type=int, help="list one page of this many entries")
+    ls.add_argument('--cursor', help="cursor printed by the previous page")
+
+    search = commands.add_parser('search', help="find entries by website, username and dates, without passwords")
+    search.add_argument('text', nargs='?', help="text to find in the website or username, case-insensitively")
+    mode = search.add_mutually_exclusive_group()
+    mode.add_argument('--prefix', action='store_const', dest='mode', const='prefix', default='substring',
+                      help="match the start of the website or username")
+    mode.add_argument('--fuzzy', action='store_const', dest='mode', const='fuzzy', help="also match misspellings, best first")
+    search.add_argument('--field', choices=('website', 'username'), help="only match this field")
+    for date in ('created', 'modified'):
+        search.add_argument('--{}-after'.format(date), metavar='DATE', help="YYYY-MM-DD[ HH:MM:SS], included")
+        search.add_argument('--{}-before'.format(date), metavar='DATE', help="YYYY-MM-DD[ HH:MM:SS], excluded")
+    search.add_argument('--limit', type=int, help="list one page of this many entries")
+    search.add_argument('--cursor', type=int, help="cursor printed by the previous page")
+
+    import_ = commands.add_parser('import', help="merge the entries of a .json, .ndjson, .db or .pmv file into the vault")
+    import_.add_argument('source')
+
+    export = commands.add_parser('export', help="write the vault to a .ndjson, .db or .pmv file")
+    export.add_argument('destination')
+
+    generate = commands.add_parser('generate', help="generate passwords without storing them")
+    generate.add_argument('-n', '--count', type=int, default=1)
+    add_policy_arguments(generate)
+
+    rotate = commands.add_parser('rotate-key', help="re-encrypt the vault, and other vault files, under a new master key")
+    rotate.add_argument('vaults', nargs='*', help="more .ndjson, .db or .pmv files to re-encrypt, besides those in save_password_dir and default_db_dir")
+    rotate.add_argument('--keep-old-key', action='store_true', help="keep the old key, to decrypt files left out")
+
+    stats = commands.add_parser('stats', help="print the metrics recorded with --metrics, or a --profile capture")
+    output_format = stats.add_mutually_exclusive_group()
+    output_format.add_argument('--prometheus', action='store_true', help="in the Prometheus text format")
+    output_format.add_argument('--raw', action='store_true', help="the recorded histograms and counters as JSON")
+    output_format.add_argument('--profile', dest='profile_file', metavar='FILE', help="the slowest functions of a cProfile capture")
+    stats.add_argument('--limit', type=int, default=20, help="functions listed from a cProfile capture")
+    stats.add_argument('--reset', action='store_true', help="delete the recorded metrics")
+
+    batch = commands.add_parser('batch', help="add or update entries read from stdin")
+    batch.add_argument('--format', choices=('csv', 'ndjson'), default='ndjson',
+                       help="csv with a website,username,password header, or one JSON object per line")
+    add_policy_arguments(batch)
+    return parser
+
+
+def add_policy_arguments(parser):
+    parser.add_argument('--length', type=int)
+    parser.add_argument('--no-symbols', action='store_true')
+    parser.add_argument('--exclude-ambiguous', action='store_true')
+    parser.add_argument('--passphrase', action='store_true')
+
+
+def policy(manager, args):
+    overrides = {}
+    if args.length:
+        overrides['length'] = args.length
+    if args.no_symbols:
+        overrides['symbols'] = False
+    if args.exclude_ambiguous:
+        overrides['exclude_ambiguous'] = True
+    if args.passphrase:
+        overrides['passphrase'] = True
+    return manager.password_policy(**overrides)
+
+
+# Where command output goes, sys.stdout itself is redirected to stderr while a command runs.
+output = sys.stdout
+
+
+def emit(record):
+    output.write(json.dumps(record) + '\n')
+
+
+def fail(message):
+    sys.stderr.write(json.dumps({'error': message}) + '\n')
+    return 1
+
+
+class Vault:
+    # The password manager plus the vault file it was loaded from.
+    # A .db vault is used live through the SQLite storage backend, .ndjson and
+    # .pmv vaults are loaded into memory and written back after a change.
+    def __init__(self, args):
+        from passmanager import PasswordManager
+        options = {}
+        path = args.vault
+        if path and path.lower().endswith('.db'):
+            options = {'storage_backend': 'sqlite', 'storage_db_path': os.path.abspath(path)}
+        self.manager = PasswordManager(args.config, options)
+        if self.manager.config.storage_backend == 'sqlite':
+            self.path = None
+        else:
+            self.path = os.path.abspath(path or os.path.join(self.manager.config.save_password_dir, 'vault.ndjson'))
+        self.loaded = False
+
+    def load(self):
+        if self.path and not self.loaded and os.path.exists(self.path):
+            if self.binary:
+                self.manager.load_from_binary(self.path)
+            else:
+                self.manager.load_from_file(self.path)
+        self.loaded = True
+
+    @property
+    def binary(self):
+        return self.path is not None and self.path.lower().endswith('.pmv')
+
+    def get(self, website, username):
+        # Looks the entry up without loading the whole vault file. Only .db and .pmv vaults
+        # have an index to look it up in, an NDJSON vault is still read once from start to end.
+        if self.path is None:
+            return self.manager.get_password(website, username)
+        if not os.path.exists(self.path):
+            return None
+        if self.binary:
+            return self.manager.get_password_from_binary(self.path, website, username)
+        import vaultfile
+        # The record modified last wins, the later one on a tie, as when the vault is loaded.
+        found = None
+        for record in vaultfile.find_records(self.path, website, username):
+            if found is None or record.modified >= found.modified:
+                found = record
+        if found is None or found.deleted:
+            return None
+        return self.manager.decrypt_password(self.manager.unwrap_many([found], save=False)[0].password)
+
+    def save(self):
+        # Write changes back, an NDJSON vault only gets the changed and deleted entries appended.
+        if self.path is None:
+            return
+        if self.binary:
+            self.manager.export_to_binary(self.path)
+        else:
+            self.manager.save_to_file(self.path, overwrite=True)
+
+    def close(self):
+        self.manager.close()
+
+
+def read_batch(stream, fmt):
+    if fmt == 'csv':
+        import csv
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def run(args, vault):
+    manager = vault.manager
+    if args.command == 'get':
+        password = vault.get(args.website, args.username)
+        if password is None:
+            return fail("No entry for {} ({})".format(args.website, args.username))
+        if args.raw:
+            output.write(password + '\n')
+        else:
+            emit({'website': args.website, 'username': args.username, 'password': password})
+    elif args.command == 'add':
+        if args.generate:
+            password = manager.generate_password()
+        elif args.stdin:
+            password = sys.stdin.readline().rstrip('\n')
+        else:
+            password = args.password
+        vault.load()
+        added, updated = manager.add_passwords([(args.website, args.username, password)])
+        vault.save()
+        emit({'website': args.website, 'username': args.username, 'added': bool(added),
+              'password': password if args.generate else None})
+    elif args.command == 'rm':
+        vault.load()
+        if manager.passwords.get(args.website, args.username) is None:
+            return fail("No entry for {} ({})".format(args.website, args.username))
+        manager.delete_password(args.website, args.username)
+        vault.save()
+        emit({'website': args.website, 'username': args.username, 'deleted': True})
+    elif args.command == 'ls':
+        from entries import format_date
+        vault.load()
+        if args.website:
+            entries, cursor = manager.passwords.for_website(args.website), None
+        elif args.limit:
+            entries, cursor = manager.passwords.page(json.loads(args.cursor) if args.cursor else None, args.limit)
+        else:
+            entries, cursor = manager.passwords, None
+        for entry in entries:
+            emit({'website': entry.website, 'username': entry.username,
+                  'date_created': format_date(entry.created), 'date_modified': format_date(entry.modified)})
+        if cursor is not None:
+            sys.stderr.write(json.dumps({'next_cursor': cursor}) + '\n')
+    elif args.command == 'search':
+        from entries import parse_date, format_date
+
+        def date_range(after, before):
+            if after is None and before is None:
+                return None
+            return (None if after is None else parse_date(after), None if before is None else parse_date(before))
+
+        vault.load()
+        results = manager.search(args.text, args.mode, args.field,
+                                 date_range(args.created_after, args.created_before),
+                                 date_range(args.modified_after, args.modified_before))
+        if args.limit:
+            entries, cursor = results.page(args.cursor, args.limit)
+        else:
+            entries, cursor = results, None
+        for entry in entries:
+            emit({'website': entry.website, 'username': entry.username,
+                  'date_created': format_date(entry.created), 'date_modified': format_date(entry.modified)})
+        if cursor is not None:
+            sys.stderr.write(json.dumps({'next_cursor': cursor}) + '\n')
+    elif args.command == 'import':
+        vault.load()
+        manager.merge(manager.vault_records(args.source, tombstones=True))
+        vault.save()
+        emit({'imported': args.source, 'entries': len(manager.passwords)})
+    elif args.command == 'export':
+        source = manager.config.storage_db_path if vault.path is None else vault.path
+        if not os.path.exists(source):
+            return fail("No vault at {}".format(source))
+        manager.convert_vault(source, args.destination)
+        emit({'exported': args.destination})
+    elif args.command == 'generate':
+        for password in manager.generate_passwords(args.count, policy(manager, args)):
+            emit({'password': password})
+    elif args.command == 'rotate-key':
+        # Vault files are re-encrypted where they are, without loading them.
+        vaults = ([vault.path] if vault.path else []) + args.vaults
+        count = manager.rotate_key(vaults, retire=not args.keep_old_key, progress=False)
+        result = {'rotated': count, 'retired': not args.keep_old_key}
+        if not args.keep_old_key:
+            result['retired_keys'] = manager.config.retired_keys_filepath
+        emit(result)
+    elif args.command == 'stats':
+        import metrics
+        if args.profile_file:
+            import pstats
+            profile = pstats.Stats(args.profile_file)
+            functions = sorted(profile.stats.items(), key=lambda item: item[1][3], reverse=True)
+            for (filename, line, name), (calls, primitive_calls, total, cumulative, callers) in functions[:args.limit]:
+                emit({'function': '{}:{}({})'.format(filename, line, name), 'calls': calls,
+                      'total': total, 'cumulative': cumulative})
+            return 0
+        path = manager.config.metrics_path
+        if args.reset:
+            if os.path.exists(path):
+                os.remove(path)
+            metrics.registry.reset()
+            emit({'reset': path})
+            return 0
+        # What this process recorded so far, plus the runs saved before.
+        total = metrics.Registry()
+        saved = metrics.load(path)
+        if saved is not None:
+            total.merge(saved)
+        total.merge(metrics.registry.snapshot())
+        snapshot = total.snapshot()
+        if args.prometheus:
+            output.write(metrics.prometheus(snapshot))
+        elif args.raw:
+            emit(snapshot)
+        else:
+            emit({'operations': total.summary(), 'counters': snapshot['counters']})
+    elif args.command == 'batch':
+        rows = list(read_batch(sys.stdin, args.format))
+        missing = [row for row in rows if not row.get('password')]
+        for row, password in zip(missing, manager.generate_passwords(len(missing), policy(manager, args))):
+            row['password'] = password
+        vault.load()
+        added, updated = manager.add_passwords((row['website'], row['username'], row['password']) for row in rows)
+        vault.save()
+        for row in missing:
+            emit({'website': row['website'], 'username': row['username'], 'password': row['password']})
+        emit({'added': len(added), 'updated': len(updated)})
+    return 0
+
+
+def main(argv=None):
+    global output
+    args = build_parser().parse_args(argv)
+    output = sys.stdout
+    if args.metrics:
+        import metrics
+        metrics.enable()
+    try:
+        # Status messages printed by the password manager go to stderr.
+        with contextlib.redirect_stdout(sys.stderr):
+            with contextlib.ExitStack() as stack:
+                if args.profile:
+                    import metrics
+                    stack.enter_context(metrics.profile(args.profile))
+                vault = Vault(args)
+                try:
+                    return run(args, vault)
+                finally:
+                    vault.close()
+    except (OSError, ValueError, KeyError) as e:
+        fail(str(e))
+        return 2
+    except Exception as e:
+        # Anything else still gets a JSON error, such as an entry encrypted with a retired master key.
+        from cryptography.fernet import InvalidToken
+        if isinstance(e, InvalidToken):
+            fail("Could not decrypt the password, it was encrypted with another master key")
+        else:
+            fail("{}: {}".format(type(e).__name__, e))
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
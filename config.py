@@ -20,5 +20,28 @@ class Config:
         self.default_db_dir = config.get('DEFAULT', 'default_db_dir', fallback=os.path.join(self.app_file_path,'Database', 'db', 'Passwords'))
         self.default_db_name = config.get('DEFAULT', 'default_db_name', fallback='passwords'+ '_' + datetime.datetime.now().strftime('%Y_%m_%d') + '.db')
         self.default_db_path = config.get('DEFAULT', 'default_db_path', fallback=os.path.join(self.app_file_path, self.default_db_dir, self.default_db_name))
+        self.storage_backend = config.get('DEFAULT', 'storage_backend', fallback='memory')
+        self.storage_db_path = config.get('DEFAULT', 'storage_db_path', fallback=os.path.join(self.app_file_path, self.default_db_dir, 'vault.db'))
+        self.page_size = config.getint('DEFAULT', 'page_size', fallback=500)
+        self.vault_compact_ratio = config.getfloat('DEFAULT', 'vault_compact_ratio', fallback=0.5)
+        self.cache_size = config.getint('DEFAULT', 'cache_size', fallback=1024)
+        self.cache_ttl = config.getint('DEFAULT', 'cache_ttl', fallback=300)
+        self.crypto_workers = config.getint('DEFAULT', 'crypto_workers', fallback=os.cpu_count() or 1)
+        self.crypto_chunk_size = config.getint('DEFAULT', 'crypto_chunk_size', fallback=1000)
+        self.crypto_executor = config.get('DEFAULT', 'crypto_executor', fallback='thread')
+        self.audit_state_path = config.get('DEFAULT', 'audit_state_path', fallback=os.path.join(self.app_file_path, 'audit.json'))
+        self.breach_list_path = config.get('DEFAULT', 'breach_list_path', fallback='')
+        self.password_length = config.getint('DEFAULT', 'password_length', fallback=12)
+        self.password_symbols = config.getboolean('DEFAULT', 'password_symbols', fallback=True)
+        self.password_exclude_ambiguous = config.getboolean('DEFAULT', 'password_exclude_ambiguous', fallback=False)
+        self.passphrase_words = config.getint('DEFAULT', 'passphrase_words', fallback=6)
+        self.wordlist_path = config.get('DEFAULT', 'wordlist_path', fallback='')
+        self.agent_socket_path = config.get('DEFAULT', 'agent_socket_path', fallback=os.path.join(self.app_file_path, 'agent', 'agent.sock'))
+        self.agent_idle_timeout = config.getfloat('DEFAULT', 'agent_idle_timeout', fallback=900)
+        self.key_rotation_state_path = config.get('DEFAULT', 'key_rotation_state_path', fallback=os.path.join(self.app_file_path, 'rotation.json'))
+        self.retired_keys_filepath = config.get('DEFAULT', 'retired_keys_filepath', fallback=os.path.join(self.app_file_path, self.master_key_dir, 'retired.key'))
+        self.search_fuzzy_cutoff = config.getfloat('DEFAULT', 'search_fuzzy_cutoff', fallback=0.6)
+        self.metrics = config.getboolean('DEFAULT', 'metrics', fallback=False)
+        self.metrics_path = config.get('DEFAULT', 'metrics_path', fallback=os.path.join(self.app_file_path, 'metrics.json'))
         if options:
             self.__dict__.update(options)
\ No newline at end of file
@@ -0,0 +1,395 @@
+import sys
+import datetime
+import itertools
+import threading
+import functools
+import contextlib
+
+import metrics
+
+# How dates are written to vault files and databases, in local time.
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(text):
+    # Epoch seconds of a date read from a vault file or database.
+    return int(datetime.datetime.fromisoformat(text).timestamp())
+
+
+@functools.lru_cache(maxsize=4096)
+def format_date(epoch):
+    return datetime.datetime.fromtimestamp(epoch).strftime(DATE_FORMAT)
+
+
+class Entry:
+    # One stored password. Dates are epoch seconds and only formatted where they are
+    # written out, website and username strings are interned so entries of the same
+    # website share one string, and __slots__ leaves out the per-instance dict.
+    __slots__ = ('website', 'username', 'password', 'created', 'modified', 'wrapped')
+    deleted = False
+
+    def __init__(self, website, username, password, created, modified, wrapped=False):
+        self.website = sys.intern(website)
+        self.username = sys.intern(username)
+        self.password = password
+        self.created = created
+        self.modified = modified
+        # True while the password still carries the extra encryption layer of a legacy JSON file.
+        self.wrapped = wrapped
+
+    def __repr__(self):
+        return 'Entry({!r}, {!r})'.format(self.website, self.username)
+
+    @classmethod
+    def from_record(cls, record, wrapped=False):
+        # Entry from a record with formatted dates, as stored in vault files.
+        return cls(record['website'], record['username'], record['password'],
+                   parse_date(record['date_created']), parse_date(record['date_modified']), wrapped)
+
+    def record(self):
+        return {
+            'website': self.website,
+            'username': self.username,
+            'password': self.password,
+            'date_created': format_date(self.created),
+            'date_modified': format_date(self.modified),
+        }
+
+
+class Tombstone:
+    # A deleted entry, kept until the deletion has reached every copy of the vault.
+    # `modified` is when the entry was deleted.
+    __slots__ = ('website', 'username', 'modified')
+    deleted = True
+    wrapped = False
+    password = None
+
+    def __init__(self, website, username, modified):
+        self.website = website
+        self.username = username
+        self.modified = modified
+
+    def __repr__(self):
+        return 'Tombstone({!r}, {!r})'.format(self.website, self.username)
+
+    def record(self):
+        return {'website': self.website, 'username': self.username, 'date_modified': format_date(self.modified), 'deleted': True}
+
+
+class EntryStore:
+    # In-memory entry store indexed by (website, username).
+    # `entries` is the primary index and keeps insertion order, `websites` maps
+    # a website to the usernames stored for it so per-site lookups stay cheap.
+    # `index` holds the search indexes, built on the first search, see search.SearchIndex.
+    def __init__(self, entries=None):
+        self.entries = {}
+        self.websites = {}
+        self.index = None
+        if entries:
+            for entry in entries:
+                self.add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def add(self, entry):
+        # Insert an entry, replacing any existing entry with the same key.
+        self._add(entry)
+        if self.index is not None:
+            self.index.add(entry)
+
+    def _add(self, entry):
+        self.entries[(entry.website, entry.username)] = entry
+        self.websites.setdefault(entry.website, {})[entry.username] = entry
+
+    def get(self, website, username):
+        return self.entries.get((website, username))
+
+    def remove(self, website, username):
+        # Remove and return the entry for the given key, or None if missing.
+        entry = self.entries.pop((website, username), None)
+        if entry is not None:
+            accounts = self.websites[website]
+            del accounts[username]
+            if not accounts:
+                del self.websites[website]
+            if self.index is not None:
+                self.index.remove(website, username)
+        return entry
+
+    def add_many(self, entries):
+        if self.index is None:
+            for entry in entries:
+                self._add(entry)
+            return
+        entries = list(entries)
+        for entry in entries:
+            self._add(entry)
+        self.index.add_many(entries)
+
+    def for_website(self, website):
+        # All entries stored for a website.
+        return list(self.websites.get(website, {}).values())
+
+    def page(self, cursor=None, limit=500):
+        # One page of entries in insertion order, and the cursor for the next page (None when done).
+        start = cursor or 0
+        entries = list(itertools.islice(self.entries.values(), start, start + limit))
+        next_cursor = start + limit if start + limit < len(self.entries) else None
+        return entries, next_cursor
+
+    def search(self, query, offset=0):
+        # Lazily yield the entries matching a search.Query, from the `offset`-th one on. Text
+        # matches come by matched term, in order, or best first when fuzzy, see search.SearchIndex.
+        if self.index is None:
+            from search import SearchIndex
+            self.index = SearchIndex(self.entries.values())
+        return itertools.islice(self.index.search(query, self.get), offset, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.websites.clear()
+        if self.index is not None:
+            self.index.clear()
+
+    def close(self):
+        pass
+
+
+def _has_key_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'passwords_key'").fetchone() is not None
+
+
+def wrapped_column(conn):
+    # SQL for the wrapped flag of the rows of a passwords table. Tables without the
+    # passwords_key index were written by the first version, whose exports encrypted
+    # the already encrypted passwords again, so their rows carry an extra layer like
+    # legacy .json vaults. Later tables without the column hold a single layer.
+    if 'wrapped' in [row[1] for row in conn.execute('PRAGMA table_info(passwords)')]:
+        return 'wrapped'
+    return '0' if _has_key_index(conn) else '1'
+
+
+def migrate_table(conn):
+    # Create the passwords table, or bring one written by an older version up to date.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS passwords
+        (website TEXT, username TEXT, password TEXT, date_created DATE, date_modified DATE, wrapped INTEGER DEFAULT 0)
+        ''')
+    wrapped = wrapped_column(conn)
+    if wrapped != 'wrapped':
+        conn.execute('ALTER TABLE passwords ADD COLUMN wrapped INTEGER DEFAULT {}'.format(wrapped))
+        if wrapped == '1':
+            conn.execute('UPDATE passwords SET wrapped = 1')
+    if not _has_key_index(conn):
+        # Tables written by older exports may hold duplicate rows, keep the newest one per key.
+        conn.execute('''
+            DELETE FROM passwords WHERE rowid NOT IN
+            (SELECT MAX(rowid) FROM passwords GROUP BY website, username)
+            ''')
+        conn.execute('CREATE UNIQUE INDEX passwords_key ON passwords (website, username)')
+
+
+class SQLiteEntryStore:
+    # Entry store that works directly against a SQLite database.
+    # Every operation is an indexed query on one long-lived connection, sqlite3
+    # keeps the prepared statements in its statement cache between calls.
+    def __init__(self, filepath, page_size=500):
+        import sqlite3
+        self.filepath = filepath
+        self.page_size = page_size
+        # Autocommit mode, writes that touch several rows open their own transaction.
+        self.conn = sqlite3.connect(filepath, isolation_level=None, cached_statements=64, check_same_thread=False)
+        metrics.trace_sql(self.conn)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('BEGIN')
+            migrate_table(self.conn)
+        # For date range searches.
+        self.conn.execute('CREATE INDEX IF NOT EXISTS passwords_created ON passwords (date_created)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS passwords_modified ON passwords (date_modified)')
+        self.fuzzy = False
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM passwords').fetchone()[0]
+
+    def __iter__(self):
+        # Walks the table a page at a time so memory stays constant.
+        cursor = None
+        while True:
+            entries, cursor = self.page(cursor)
+            yield from entries
+            if cursor is None:
+                break
+
+    def __contains__(self, key):
+        row = self.conn.execute('SELECT 1 FROM passwords WHERE website = ? AND username = ?', key).fetchone()
+        return row is not None
+
+    def _entry(self, row):
+        return Entry(row[0], row[1], row[2], parse_date(row[3]), parse_date(row[4]), bool(row[5]))
+
+    def _values(self, entry):
+        return (entry.website, entry.username, entry.password, format_date(entry.created), format_date(entry.modified), entry.wrapped)
+
+    def add(self, entry):
+        # Insert an entry, replacing any existing entry with the same key.
+        self.conn.execute('''
+            INSERT INTO passwords (website, username, password, date_created, date_modified, wrapped) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (website, username) DO UPDATE SET
+            password = excluded.password, date_created = excluded.date_created, date_modified = excluded.date_modified,
+            wrapped = excluded.wrapped
+            ''', self._values(entry))
+
+    def add_many(self, entries):
+        # Insert several entries in a single transaction.
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('''
+                INSERT INTO passwords (website, username, password, date_created, date_modified, wrapped) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (website, username) DO UPDATE SET
+                password = excluded.password, date_created = excluded.date_created, date_modified = excluded.date_modified,
+                wrapped = excluded.wrapped
+                ''', (self._values(entry) for entry in entries))
+
+    def get(self, website, username):
+        row = self.conn.execute('''
+            SELECT website, username, password, date_created, date_modified, wrapped FROM passwords
+            WHERE website = ? AND username = ?
+            ''', (website, username)).fetchone()
+        return self._entry(row) if row else None
+
+    def remove(self, website, username):
+        # Remove and return the entry for the given key, or None if missing.
+        entry = self.get(website, username)
+        if entry is not None:
+            self.conn.execute('DELETE FROM passwords WHERE website = ? AND username = ?', (website, username))
+        return entry
+
+    def for_website(self, website):
+        # All entries stored for a website.
+        rows = self.conn.execute('''
+            SELECT website, username, password, date_created, date_modified, wrapped FROM passwords
+            WHERE website = ? ORDER BY username
+            ''', (website,))
+        return [self._entry(row) for row in rows]
+
+    def page(self, cursor=None, limit=None):
+        # One page of entries ordered by key, and the cursor for the next page (None when done).
+        limit = limit or self.page_size
+        if cursor is None:
+            rows = self.conn.execute('''
+                SELECT website, username, password, date_created, date_modified, wrapped FROM passwords
+                ORDER BY website, username LIMIT ?
+                ''', (limit,)).fetchall()
+        else:
+            rows = self.conn.execute('''
+                SELECT website, username, password, date_created, date_modified, wrapped FROM passwords
+                WHERE (website, username) > (?, ?) ORDER BY website, username LIMIT ?
+                ''', (cursor[0], cursor[1], limit)).fetchall()
+        entries = [self._entry(row) for row in rows]
+        next_cursor = (rows[-1][0], rows[-1][1]) if len(rows) == limit else None
+        return entries, next_cursor
+
+    def search(self, query, offset=0):
+        # Lazily yield the entries matching a search.Query, from the `offset`-th one on, fetched a page at a time.
+        # Text matches come ordered by key, or best first when fuzzy. Without text, the entries in the date
+        # range come oldest first, using the date indexes.
+        columns = 'website, username, password, date_created, date_modified, wrapped'
+        conditions = []
+        parameters = []
+        if query.text:
+            if query.mode == 'fuzzy':
+                if not self.fuzzy:
+                    from search import similarity
+                    self.conn.create_function('similarity', 3, similarity, deterministic=True)
+                    self.fuzzy = True
+                scores = ['similarity(?, lower({}), ?)'.format(field) for field in query.fields]
+                columns += ', {} AS score'.format(scores[0] if len(scores) == 1 else 'MAX({})'.format(', '.join(scores)))
+                conditions.append('score >= ?')
+                parameters += [query.text, query.cutoff] * len(scores) + [query.cutoff]
+            elif query.mode == 'prefix':
+                conditions.append('({})'.format(' OR '.join('substr(lower({}), 1, ?) = ?'.format(field) for field in query.fields)))
+                parameters += [len(query.text), query.text] * len(query.fields)
+            else:
+                conditions.append('({})'.format(' OR '.join('instr(lower({}), ?) > 0'.format(field) for field in query.fields)))
+                parameters += [query.text] * len(query.fields)
+        for column, bounds in (('date_created', query.created), ('date_modified', query.modified)):
+            if bounds is not None:
+                # The stored dates are formatted so that they sort in date order.
+                if bounds[0] is not None:
+                    conditions.append(column + ' >= ?')
+                    parameters.append(format_date(bounds[0]))
+                if bounds[1] is not None:
+                    conditions.append(column + ' < ?')
+                    parameters.append(format_date(bounds[1]))
+        if query.text and query.mode == 'fuzzy':
+            order = 'score DESC, website, username'
+        elif query.text:
+            order = 'website, username'
+        elif query.modified is not None:
+            order = 'date_modified, website, username'
+        else:
+            order = 'date_created, website, username'
+        sql = 'SELECT {} FROM passwords{} ORDER BY {} LIMIT ? OFFSET ?'.format(
+            columns, ' WHERE ' + ' AND '.join(conditions) if conditions else '', order)
+        while True:
+            rows = self.conn.execute(sql, parameters + [self.page_size, offset]).fetchall()
+            for row in rows:
+                yield self._entry(row)
+            if len(rows) < self.page_size:
+                break
+            offset += len(rows)
+
+    def clear(self):
+        self.conn.execute('DELETE FROM passwords')
+
+    def close(self):
+        self.conn.close()
+
+
+class RWLock:
+    # Reader-writer lock for sharing a store between threads: any number of
+    # readers, or one writer. Waiting writers block new readers so they are not starved.
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.condition:
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
@@ -0,0 +1,142 @@
+import string
+import secrets
+import functools
+
+AMBIGUOUS = 'Il1|O0o`\'"'
+CLASSES = {
+    'lowercase': string.ascii_lowercase,
+    'uppercase': string.ascii_uppercase,
+    'digits': string.digits,
+    'symbols': string.punctuation,
+}
+# Random bytes are drawn from the OS in blocks of at least this size.
+BLOCK_SIZE = 64
+
+
+class PasswordPolicy:
+    # What generated passwords must look like.
+    # Character mode draws `length` characters from the enabled classes, and with
+    # require_each every enabled class appears at least once. Passphrase mode
+    # joins `words` words from `wordlist` (one word per line, diceware lines
+    # like "11111 word" are accepted) with `separator`.
+    def __init__(self, length=12, lowercase=True, uppercase=True, digits=True, symbols=True,
+                 require_each=True, exclude_ambiguous=False, exclude='',
+                 passphrase=False, words=6, separator='-', wordlist=None):
+        self.length = length
+        self.lowercase = lowercase
+        self.uppercase = uppercase
+        self.digits = digits
+        self.symbols = symbols
+        self.require_each = require_each
+        self.exclude_ambiguous = exclude_ambiguous
+        self.exclude = exclude
+        self.passphrase = passphrase
+        self.words = words
+        self.separator = separator
+        self.wordlist = wordlist
+
+    def classes(self):
+        # Character sets of the enabled classes, without excluded characters.
+        excluded = set(self.exclude) | (set(AMBIGUOUS) if self.exclude_ambiguous else set())
+        classes = []
+        for name, chars in CLASSES.items():
+            if getattr(self, name):
+                chars = ''.join(c for c in chars if c not in excluded)
+                if chars:
+                    classes.append(chars)
+        if not classes:
+            raise ValueError("The password policy leaves no characters to choose from")
+        if self.require_each and len(classes) > self.length:
+            raise ValueError("A password of length {} cannot hold {} required character classes".format(self.length, len(classes)))
+        return classes
+
+
+_wordlists = {}
+
+
+def load_wordlist(filepath):
+    if filepath not in _wordlists:
+        if not filepath:
+            raise ValueError("Passphrase mode needs a wordlist file")
+        with open(filepath, 'r') as f:
+            words = list(dict.fromkeys(line.split()[-1] for line in f if line.strip()))
+        if len(words) < 2:
+            raise ValueError("The wordlist {} has too few words".format(filepath))
+        _wordlists[filepath] = words
+    return _wordlists[filepath]
+
+
+def random_indices(count, size):
+    # `count` uniform random integers in [0, size), read from the OS random source in bulk.
+    # Values are taken from k-byte groups; groups at or above the largest multiple
+    # of `size` are rejected, so there is no modulo bias.
+    width = 1
+    while 256 ** width < size:
+        width += 1
+    space = 256 ** width
+    limit = space - space % size
+    indices = []
+    while len(indices) < count:
+        missing = count - len(indices)
+        # Draw enough for the expected rejection rate, plus a little.
+        data = secrets.token_bytes(max(BLOCK_SIZE, int(missing * width * space / limit * 1.1) + width))
+        for offset in range(0, len(data) - width + 1, width):
+            value = int.from_bytes(data[offset:offset + width], 'big')
+            if value < limit:
+                indices.append(value % size)
+                if len(indices) == count:
+                    break
+    return indices
+
+
+@functools.lru_cache(maxsize=32)
+def _translation(chars):
+    limit = 256 - 256 % len(chars)
+    table = bytes(ord(chars[b % len(chars)]) if b < limit else 0 for b in range(256))
+    return table, bytes(range(limit, 256)), limit
+
+
+def random_characters(count, chars):
+    # `count` uniform random characters from the ASCII string `chars`.
+    # Fast path of random_indices: bytes.translate maps the accepted bytes to
+    # characters and deletes the rejected ones in one C-level pass.
+    if len(chars) > 256:
+        return ''.join(chars[i] for i in random_indices(count, len(chars)))
+    table, rejected, limit = _translation(chars)
+    result = []
+    produced = 0
+    while produced < count:
+        missing = count - produced
+        data = secrets.token_bytes(max(BLOCK_SIZE, int(missing * 256 / limit * 1.1) + 1))
+        accepted = data.translate(table, rejected)[:missing]
+        result.append(accepted)
+        produced += len(accepted)
+    return b''.join(result).decode('ascii')
+
+
+def generate_many(count, policy=None):
+    # Generate `count` passwords following `policy`.
+    policy = policy or PasswordPolicy()
+    if policy.passphrase:
+        words = load_wordlist(policy.wordlist)
+        indices = random_indices(count * policy.words, len(words))
+        return [policy.separator.join(words[i] for i in indices[n * policy.words:(n + 1) * policy.words])
+                for n in range(count)]
+    classes = policy.classes()
+    chars = ''.join(classes)
+    required = [frozenset(cls) for cls in classes] if policy.require_each else []
+    passwords = []
+    while len(passwords) < count:
+        # Passwords missing a required class are rejected and drawn again, which
+        # keeps the result uniform over every password the policy allows.
+        missing = count - len(passwords)
+        block = random_characters(missing * policy.length, chars)
+        for n in range(missing):
+            password = block[n * policy.length:(n + 1) * policy.length]
+            if all(not cls.isdisjoint(password) for cls in required):
+                passwords.append(password)
+    return passwords
+
+
+def generate(policy=None):
+    return generate_many(1, policy)[0]
@@ -1,9 +1,9 @@
 from passmanager import PasswordManager
 import art
 import os
+import sys
 from time import sleep
 import datetime
-import tkinter as tk
 
 
 # Create a custom configuration here:
@@ -26,13 +26,11 @@ custom_config = {
 # Entry Point 
 def main(isrunning=True):
     art.cls()
-    print("Please wait while your app is initializing...")
-    sleep(2)
     app = PasswordManager(custom_config)
     while isrunning:
         choice = ''
         print(art.main_screen)
-        print("\t1) Add entry\n\t2) Delete entry\n\t3) Edit entry\n\t4) List Entries\n\t5) Get password\n\t6) Export to Database or File\n\t7) Load from Database or File\n")
+        print("\t1) Add entry\n\t2) Delete entry\n\t3) Edit entry\n\t4) List Entries\n\t5) Get password\n\t6) Export to Database or File\n\t7) Load from Database or File\n\t8) Audit passwords\n\t9) Rotate master key\n")
         choice = input("Select an option or Press Q to quit: ")
         if choice == '1':
             art.cls()
@@ -46,8 +44,7 @@ def main(isrunning=True):
             art.cls()
             website = input("Enter the name of the website:: ")
             username = input("What's the username?: ")
-            password = input("What's the password?: ")
-            app.delete_password(website, username, password)
+            app.delete_password(website, username)
             print("This entry has been sucessfully deleted.")
             sleep(1)
         elif choice == '3':
@@ -55,13 +52,18 @@ def main(isrunning=True):
             website = input("Enter the name of the website: ")
             username = input("What's the username?: ")
             new_password = input("Enter the new password: ")
-            app.modify_password(website, username, password)
+            app.modify_password(website, username, new_password)
             print("This entry has been successfully modified.")
             sleep(1)
         elif choice == '4':
             art.cls()
+            text = input("Search for a website or username (leave empty to list all): ")
+            results = app.search(text, mode='fuzzy') if text else None
             print("List of passwords entered:\n")
-            app.list_passwords()
+            # One page at a time instead of the whole vault.
+            cursor = app.list_passwords(limit=app.config.page_size, results=results)
+            while cursor is not None and input("Press Enter for more or Q to stop: ").lower() != 'q':
+                cursor = app.list_passwords(cursor, app.config.page_size, results)
             sleep(1)
         elif choice == '5':
             website = input("Enter the name of the webiste: ")
@@ -78,7 +80,7 @@ def main(isrunning=True):
                 choice = input("Do you want to commit to these changes(y/n)?: ")
                 if choice.lower() == 'y':
                     filename = input("Enter a name for this save file: ")
-                    filename = filename + '.json'
+                    filename = filename + '.ndjson'
                     app.save_to_file(filename)
                     print("Your passwords were successfully saved to file.")
                     sleep(1)
@@ -107,8 +109,12 @@ def main(isrunning=True):
             option = input("Enter a option: ")
             if option == '1':
                 art.cls()
-                filename = input("Enter the name of the .JSON file you wish to load(without the extension): ")
-                filename = filename + '.json'
+                filename = input("Enter the name of the file you wish to load(without the extension): ")
+                # Files saved by older versions use the .json extension.
+                if os.path.exists(os.path.join(app.config.save_password_dir, filename + '.ndjson')):
+                    filename = filename + '.ndjson'
+                else:
+                    filename = filename + '.json'
                 app.load_from_file(filename)
                 sleep(1)    
             elif option == '2':
@@ -119,15 +125,41 @@ def main(isrunning=True):
                 app.load_from_database(file_path)
                 print("Database loaded successfully.")
                 sleep(1)
+        elif choice == '8':
+            art.cls()
+            breach_list = input("Enter the path of a breach list to check against (leave empty to skip): ")
+            report = app.audit(breach_list=breach_list or None)
+            print(f"Audited {report['total']} entries, {report['checked']} of them were rechecked.")
+            for accounts in report['reused']:
+                print("Reused password: " + ", ".join(f"{website} ({username})" for website, username in accounts))
+            for entry in report['breached']:
+                print(f"Breached password: {entry['website']} ({entry['username']}), seen {entry['count']} times")
+            sleep(1)
+        elif choice == '9':
+            art.cls()
+            print("Vault files this session loaded or saved, and those in the default folders, are re-encrypted too.")
+            others = input("Enter the paths of other vault files to re-encrypt, separated by commas (leave empty to skip): ")
+            vaults = list(app.changes.synced) + [path.strip() for path in others.split(',') if path.strip()]
+            try:
+                count = app.rotate_key(vaults)
+                print(f"The master key was rotated and {count} vault files were re-encrypted.")
+            except ValueError as e:
+                print(f"Error: {e}")
+            sleep(1)
         elif choice.lower() == 'q':
             art.cls()
             isrunning = False
+            app.close()
             print("Exiting program")
             sleep(1)
 
         
 
 if __name__ == '__main__':
+    # With arguments, run the scriptable command line interface instead of the menu.
+    if len(sys.argv) > 1:
+        import cli
+        sys.exit(cli.main())
     main()
  
  
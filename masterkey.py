@@ -0,0 +1,311 @@
+import os
+import json
+import hmac
+import hashlib
+import itertools
+
+import vaultfile
+import binvault
+from entries import Entry, parse_date, migrate_table
+from vaultfile import atomic_open, load_state, save_state
+
+# The master key file holds one Fernet key per line, the newest first (files
+# written by older versions hold a single key). New ciphertexts are made with
+# the first key and any key decrypts, so a vault stays readable while a key
+# rotation re-encrypts it chunk by chunk. When every vault is re-encrypted the
+# older keys are retired.
+#
+# Progress is checkpointed after every chunk, an interrupted rotation resumes
+# where it stopped: the state file of the rotation is only removed once every
+# vault is done, and while it exists its checkpoints say how far each vault
+# got. Retired keys are appended to the retired keys file rather than lost,
+# so a vault file that was left out can still be recovered.
+#
+# There is one master key for every vault, so besides the vaults listed the
+# rotation covers every vault file found in save_password_dir and default_db_dir.
+VAULT_EXTENSIONS = ('.db', '.json', '.ndjson', binvault.EXTENSION)
+
+
+def read_keys(filepath):
+    with open(filepath, 'r') as f:
+        keys = f.read().split()
+    if not keys:
+        raise ValueError("The master key file {} is empty".format(filepath))
+    return keys
+
+
+def write_keys(filepath, keys):
+    with atomic_open(filepath) as f:
+        f.write('\n'.join(keys) + '\n')
+
+
+def archive_keys(filepath, keys):
+    # Append retired keys to `filepath`, the newest last.
+    if not keys:
+        return
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    with open(filepath, 'a') as f:
+        f.write('\n'.join(reversed(keys)) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def is_vault(filepath):
+    # Whether a file found next to the vaults holds one, judging by its contents.
+    vault_format = os.path.splitext(filepath)[1].lower()
+    try:
+        if vault_format == '.db':
+            import sqlite3
+            conn = sqlite3.connect('file:{}?mode=ro'.format(filepath), uri=True)
+            try:
+                return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'passwords'").fetchone() is not None
+            finally:
+                conn.close()
+        if vault_format == binvault.EXTENSION:
+            with open(filepath, 'rb') as f:
+                return f.read(len(binvault.MAGIC)) == binvault.MAGIC
+        if vaultfile.is_ndjson(filepath):
+            return True
+        # Legacy JSON vaults are a single array.
+        with open(filepath, 'r') as f:
+            return f.read(64).lstrip().startswith('[')
+    except (OSError, ValueError, UnicodeDecodeError):
+        return False
+    except Exception as e:
+        # sqlite3.DatabaseError for a file that is not a database.
+        import sqlite3
+        if isinstance(e, sqlite3.DatabaseError):
+            return False
+        raise
+
+
+def readable(manager, filepath):
+    # Whether the first password of a vault decrypts with the keys of `manager`, an empty vault is.
+    records = manager.vault_records(filepath, tombstones=True)
+    try:
+        for entry in records:
+            if not entry.deleted:
+                manager.decrypt_password(entry.password)
+                return True
+        return True
+    except Exception:
+        return False
+    finally:
+        records.close()
+
+
+def known_vaults(manager):
+    # The vault files in the directories vaults are saved to by default. Files encrypted under
+    # another master key are left out, re-encrypting them would fail.
+    found = []
+    config = manager.config
+    for directory in (config.save_password_dir, config.default_db_dir):
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.splitext(name)[1].lower() not in VAULT_EXTENSIONS or not os.path.isfile(path) or not is_vault(path):
+                continue
+            if readable(manager, path):
+                found.append(path)
+            else:
+                print("Skipping {}, it was not encrypted with the master key".format(path))
+    return found
+
+
+def make_fernet(keys):
+    # Fernet for a single key, MultiFernet for several: it encrypts with the first and decrypts with any.
+    from cryptography.fernet import Fernet, MultiFernet
+    if isinstance(keys, (str, bytes)):
+        keys = [keys]
+    if len(keys) == 1:
+        return Fernet(keys[0])
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def key_id(key):
+    if isinstance(key, str):
+        key = key.encode()
+    return hmac.new(key, b'passmanager key id', hashlib.sha256).hexdigest()[:16]
+
+
+def print_progress(vault, done):
+    print(f"Re-encrypted {done} entries of {vault}", end='\r')
+
+
+def _rotate_entries(manager, entries):
+    # Re-encrypt the passwords of a list of entries in place under the newest key.
+    # Entries of legacy JSON files lose their extra encryption layer first.
+    if len(manager.unwrap_many(entries, save=False)) != len(entries):
+        raise ValueError("Could not remove the file encryption layer of every entry")
+    result = manager.rotate_many(entry.password for entry in entries)
+    for index, entry in enumerate(entries):
+        if index in result.errors:
+            raise ValueError("Could not re-encrypt the password for {} ({}): {!r}".format(
+                entry.website, entry.username, result.errors[index]))
+        entry.password = result.values[index]
+        entry.wrapped = False
+    return entries
+
+
+def rotate_database(manager, filepath, checkpoint, save, progress=None):
+    # Re-encrypt the rows of a database in chunks ordered by key, the last key done is the checkpoint.
+    import sqlite3
+    conn = sqlite3.connect(filepath)
+    try:
+        with conn:
+            migrate_table(conn)
+        size = manager.config.crypto_chunk_size * manager.config.crypto_workers
+        done = checkpoint.get('done', 0)
+        while True:
+            cursor = checkpoint.get('cursor')
+            query = 'SELECT website, username, password, date_created, date_modified, wrapped FROM passwords'
+            if cursor is None:
+                rows = conn.execute(query + ' ORDER BY website, username LIMIT ?', (size,)).fetchall()
+            else:
+                rows = conn.execute(query + ' WHERE (website, username) > (?, ?) ORDER BY website, username LIMIT ?',
+                                    (cursor[0], cursor[1], size)).fetchall()
+            if not rows:
+                break
+            entries = _rotate_entries(manager, [Entry(row[0], row[1], row[2], parse_date(row[3]), parse_date(row[4]), bool(row[5]))
+                                                for row in rows])
+            with conn:
+                conn.executemany('UPDATE passwords SET password = ?, wrapped = 0 WHERE website = ? AND username = ?',
+                                 ((entry.password, entry.website, entry.username) for entry in entries))
+            done += len(rows)
+            checkpoint['cursor'] = [rows[-1][0], rows[-1][1]]
+            checkpoint['done'] = done
+            save()
+            if progress:
+                progress(filepath, done)
+    finally:
+        conn.close()
+
+
+def rotate_file(manager, filepath, checkpoint, save, progress=None):
+    # Stream a vault file into a re-encrypted copy that replaces it at the end. The copy is synced
+    # after every chunk and the checkpoint holds how many records and bytes of it are complete.
+    # Tombstones are copied as they are, so the deletions still reach other copies of the vault.
+    stat = os.stat(filepath)
+    source = [stat.st_size, stat.st_mtime]
+    directory, name = os.path.split(os.path.abspath(filepath))
+    temp_path = os.path.join(directory, '.' + name + '.rotating')
+    if checkpoint.get('source') != source or not os.path.exists(temp_path):
+        # The vault file changed since the checkpoint, start over.
+        checkpoint.clear()
+        checkpoint['source'] = source
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(vaultfile.header()) + '\n')
+            checkpoint['records'] = 0
+            checkpoint['offset'] = f.tell()
+    size = manager.config.crypto_chunk_size * manager.config.crypto_workers
+    records = vaultfile.read_records(filepath, tombstones=True)
+    # Records already written are skipped without decrypting them.
+    for _ in itertools.islice(records, checkpoint['records']):
+        pass
+    with open(temp_path, 'r+') as f:
+        f.truncate(checkpoint['offset'])
+        f.seek(checkpoint['offset'])
+        while True:
+            chunk = list(itertools.islice(records, size))
+            if not chunk:
+                break
+            entries = [entry for entry in chunk if not entry.deleted]
+            if entries:
+                _rotate_entries(manager, entries)
+            f.writelines(vaultfile.format_record(record) for record in chunk)
+            f.flush()
+            os.fsync(f.fileno())
+            checkpoint['records'] += len(chunk)
+            checkpoint['offset'] = f.tell()
+            save()
+            if progress:
+                progress(filepath, checkpoint['records'])
+    os.replace(temp_path, filepath)
+    vaultfile.fsync_dir(directory)
+
+
+def rotate_binary(manager, filepath):
+    # A binary vault is rewritten in one go, its records and its index are both keyed.
+    with manager.open_binary(filepath) as vault:
+        entries = (entry for batch in manager.batches(vault) for entry in _rotate_entries(manager, batch))
+        binvault.write_vault(filepath, entries, manager.index_key(), manager.encrypt_many)
+
+
+def rotate_store(manager, progress=None):
+    # Re-encrypt the entries held in memory, they are not checkpointed.
+    done = 0
+    for batch in manager.batches():
+        manager.passwords.add_many(_rotate_entries(manager, batch))
+        done += len(batch)
+        if progress:
+            progress('memory', done)
+
+
+def rotate(manager, state_path, vaults, retire=True, progress=print_progress):
+    # Rotate the master key of `manager` and re-encrypt `vaults`, a list of .db, .ndjson/.json and
+    # .pmv paths, and the entries held in memory. Returns the number of vaults re-encrypted.
+    for vault in vaults:
+        if os.path.splitext(vault)[1].lower() not in VAULT_EXTENSIONS:
+            raise ValueError("Unsupported vault format: {}".format(vault))
+    state = load_state(state_path)
+    unfinished = any(not checkpoint.get('finished') for checkpoint in state.get('vaults', {}).values())
+    resume = unfinished and state.get('key_id') == key_id(manager.key)
+
+    def save():
+        save_state(state_path, state)
+
+    if not resume:
+        # A new rotation, whether or not older keys are still kept.
+        from cryptography.fernet import Fernet
+        vaults = list(vaults) + known_vaults(manager)
+        key = Fernet.generate_key().decode()
+        state = {'key_id': key_id(key), 'vaults': {}}
+    # Vaults of an interrupted rotation are finished too.
+    for vault in vaults:
+        state['vaults'].setdefault(os.path.abspath(vault), {})
+    # The state is saved before the key file: if the rotation stops in between,
+    # nothing is encrypted under the new key yet and the next one starts over.
+    save()
+    if not resume:
+        keys = [key] + manager.keys
+        write_keys(manager.config.master_key_filepath, keys)
+        manager.set_keys(keys)
+    if manager.config.storage_backend == 'memory':
+        rotate_store(manager, progress)
+        if progress is print_progress:
+            print()
+    # A vault that fails is left unfinished and the others are still re-encrypted. The old keys are
+    # then kept and the state file too, so the next rotation retries it once it is fixed or removed.
+    failed = []
+    for vault, checkpoint in state['vaults'].items():
+        if checkpoint.get('finished') or not os.path.exists(vault):
+            continue
+        vault_format = os.path.splitext(vault)[1].lower()
+        try:
+            if vault_format == '.db':
+                rotate_database(manager, vault, checkpoint, save, progress)
+            elif vault_format in ('.json', '.ndjson'):
+                rotate_file(manager, vault, checkpoint, save, progress)
+            else:
+                rotate_binary(manager, vault)
+        except Exception as e:
+            print("Error: Could not re-encrypt {}: {}".format(vault, e))
+            failed.append(vault)
+            continue
+        finally:
+            if progress is print_progress:
+                print()
+        checkpoint.clear()
+        checkpoint['finished'] = True
+        save()
+    if failed:
+        raise ValueError("{} of {} vaults could not be re-encrypted and the old keys were kept, "
+                         "rotate the key again to retry them".format(len(failed), len(state['vaults'])))
+    if retire:
+        archive_keys(manager.config.retired_keys_filepath, manager.keys[1:])
+        write_keys(manager.config.master_key_filepath, manager.keys[:1])
+        manager.set_keys(manager.keys[:1])
+    os.remove(state_path)
+    return len(state['vaults'])
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+import contextlib
+
+# Operation timings and counters. Off by default: enable() swaps the methods
+# listed in OPERATIONS for timed wrappers and disable() puts the originals
+# back, so while metrics are off the code runs unchanged and the only cost
+# left is the enabled check in count(), called once per operation.
+#
+# Timings are histograms in seconds with fixed buckets, so snapshots taken in
+# different processes can be added up, see Registry.merge. The CLI saves the
+# snapshot of every run with metrics on to metrics_path, `cli.py stats` prints
+# the total as JSON or in the Prometheus text format.
+enabled = False
+
+# Bucket upper bounds in seconds, 1, 2.5 and 5 times each power of ten from 1 us to 10 s.
+BUCKETS = tuple(round(factor * 10.0 ** exponent, 7) for exponent in range(-6, 2) for factor in (1, 2.5, 5))[:-2]
+
+# Operations timed while metrics are enabled: (module, class or None, {attribute: operation name}).
+OPERATIONS = (
+    ('passmanager', 'PasswordManager', {
+        'generate': 'keys.load',
+        'reload_keys': 'keys.reload',
+        'encrypt_password': 'fernet.encrypt',
+        'decrypt_password': 'fernet.decrypt',
+        'encrypt_many': 'fernet.encrypt_many',
+        'decrypt_many': 'fernet.decrypt_many',
+        'rotate_many': 'fernet.rotate_many',
+        'add_password': 'vault.add',
+        'add_passwords': 'vault.add_many',
+        'get_password': 'vault.get',
+        'modify_password': 'vault.modify',
+        'delete_password': 'vault.delete',
+        'merge': 'vault.merge',
+        'save_to_file': 'file.save',
+        'load_from_file': 'file.load',
+        'export_to_database': 'database.export',
+        'load_from_database': 'database.load',
+        'export_to_binary': 'binary.export',
+        'load_from_binary': 'binary.load',
+        'get_password_from_binary': 'binary.get',
+        'convert_vault': 'vault.convert',
+        'rotate_key': 'keys.rotate',
+        'audit': 'vault.audit',
+    }),
+    ('search', 'SearchIndex', {
+        'add_many': 'memory.index',
+        'search': 'memory.search',
+    }),
+    ('entries', 'SQLiteEntryStore', {
+        'add': 'sqlite.add',
+        'add_many': 'sqlite.add_many',
+        'get': 'sqlite.get',
+        'remove': 'sqlite.remove',
+        'for_website': 'sqlite.for_website',
+        'page': 'sqlite.page',
+        'search': 'sqlite.search',
+    }),
+    ('vaultfile', None, {
+        'dumps': 'json.encode',
+        'loads': 'json.decode',
+    }),
+    ('binvault', None, {
+        'write_vault': 'binary.write',
+    }),
+)
+
+
+class Histogram:
+    # Counts of observed durations per bucket, the last count is for those above every bucket.
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th quantile, the maximum for the last bucket.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'counts': self.counts, 'sum': self.sum, 'count': self.count, 'max': self.max}
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.sum += data['sum']
+        self.count += data['count']
+        self.max = max(self.max, data['max'])
+
+
+class Registry:
+    # Histograms by operation and counters by name. Thread-safe.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'buckets': list(BUCKETS),
+                'operations': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, snapshot):
+        # Add a snapshot, from this or another process, to this registry.
+        if snapshot.get('buckets') != list(BUCKETS):
+            raise ValueError("Metrics were recorded with different histogram buckets")
+        with self.lock:
+            for name, data in snapshot['operations'].items():
+                self.histograms.setdefault(name, Histogram()).merge(data)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def summary(self):
+        # Per operation: calls, total, mean, p50, p99 and max in seconds.
+        with self.lock:
+            return {name: {'calls': h.count, 'total': h.sum, 'mean': h.sum / h.count if h.count else 0.0,
+                           'p50': h.quantile(0.5), 'p99': h.quantile(0.99), 'max': h.max}
+                    for name, h in sorted(self.histograms.items())}
+
+
+registry = Registry()
+# (owner, attribute, original) of every wrapped function, to restore them.
+_originals = []
+
+
+def count(name, value=1):
+    # Add to a counter, such as entries processed or bytes read and written.
+    if enabled:
+        registry.count(name, value)
+
+
+def observe(name, seconds):
+    if enabled:
+        registry.observe(name, seconds)
+
+
+def timed(name, function):
+    # Wrap a function so each call is observed under `name`. For a generator function
+    # the time spent producing its items is observed once it is exhausted or closed.
+    import inspect
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            elapsed = 0.0
+            iterator = function(*args, **kwargs)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - start
+                    yield item
+            finally:
+                iterator.close()
+                registry.observe(name, elapsed)
+        return wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            registry.observe(name, time.perf_counter() - start)
+    return wrapper
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    import importlib
+    for module_name, class_name, names in OPERATIONS:
+        owner = importlib.import_module(module_name)
+        if class_name is not None:
+            owner = getattr(owner, class_name)
+        for attribute, name in names.items():
+            original = owner.__dict__[attribute] if class_name is not None else getattr(owner, attribute)
+            _originals.append((owner, attribute, original))
+            setattr(owner, attribute, timed(name, original))
+    enabled = True
+
+
+def disable():
+    global enabled
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+    enabled = False
+
+
+def trace_sql(conn):
+    # Count the statements run on a SQLite connection by kind, sqlite.select, sqlite.insert and so on.
+    if enabled:
+        conn.set_trace_callback(lambda statement: registry.count('sqlite.' + statement.lstrip().split(None, 1)[0].lower()))
+
+
+def load(filepath):
+    if os.path.exists(filepath):
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    return None
+
+
+def save(filepath):
+    # Add the metrics recorded since the last save to the totals in `filepath`.
+    from vaultfile import atomic_open
+    total = Registry()
+    saved = load(filepath)
+    if saved is not None:
+        total.merge(saved)
+    total.merge(registry.snapshot())
+    registry.reset()
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    with atomic_open(filepath) as f:
+        json.dump(total.snapshot(), f)
+
+
+def prometheus(snapshot, prefix='passmanager'):
+    # A snapshot in the Prometheus text exposition format.
+    lines = ['# TYPE {}_operation_seconds histogram'.format(prefix)]
+    buckets = snapshot['buckets']
+    for name, data in sorted(snapshot['operations'].items()):
+        label = 'operation="{}"'.format(name)
+        cumulative = 0
+        for bound, count in zip(buckets + ['+Inf'], data['counts']):
+            cumulative += count
+            lines.append('{}_operation_seconds_bucket{{{},le="{}"}} {}'.format(prefix, label, bound, cumulative))
+        lines.append('{}_operation_seconds_sum{{{}}} {}'.format(prefix, label, data['sum']))
+        lines.append('{}_operation_seconds_count{{{}}} {}'.format(prefix, label, data['count']))
+    for name, value in sorted(snapshot['counters'].items()):
+        metric = '{}_{}_total'.format(prefix, name.replace('.', '_'))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+    return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profile(filepath):
+    # Capture a cProfile of the block into `filepath`, read it with pstats or `cli.py stats --profile`.
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filepath)
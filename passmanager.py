@@ -1,33 +1,75 @@
 # Built-in modules
-import string
-import random
-import datetime
-import json
 import os
-from cryptography.fernet import Fernet
-import sqlite3
+import time
+import itertools
+# cryptography, sqlite3 and the generator and audit modules are imported where
+# they are first needed, so that commands which don't use them start faster.
 
 
 from config import Config
+from entries import Entry, Tombstone, EntryStore, SQLiteEntryStore, parse_date, format_date, wrapped_column, migrate_table
+from cache import PlaintextCache
+from changes import ChangeTracker
+from masterkey import read_keys, make_fernet
+from batch import BatchResult, run_batch
+import vaultfile
+import binvault
+import metrics
 
 class PasswordManager:
-    def __init__(self, config_file=None):
-        self.passwords = []
-        self.key = Fernet.generate_key()
-        self.fernet = Fernet(self.key)
-        self.config = Config(config_file=config_file)
+    def __init__(self, config_file=None, options=None):
+        self.key = None
+        self.keys = []
+        self._fernet = None
+        start = time.perf_counter()
+        self.config = Config(options=options, config_file=config_file)
+        if self.config.metrics:
+            metrics.enable()
+        metrics.observe('config.load', time.perf_counter() - start)
         self.conn = None
         self.generate()
+        self.passwords = self.open_store()
+        self.cache = PlaintextCache(maxsize=self.config.cache_size, ttl=self.config.cache_ttl)
+        # Entries changed since each vault file and database was last synced, see save_to_file.
+        self.changes = ChangeTracker()
+        # Records in each vault file this vault was loaded from or saved to, superseded ones included.
+        self.file_records = {}
+
+    @property
+    def fernet(self):
+        if self._fernet is None:
+            self._fernet = make_fernet(self.keys)
+        return self._fernet
+
+    def open_store(self):
+        # Entries live in memory by default, or directly in SQLite with storage_backend = sqlite.
+        backend = self.config.storage_backend
+        if backend == 'memory':
+            return EntryStore()
+        elif backend == 'sqlite':
+            return SQLiteEntryStore(self.config.storage_db_path, page_size=self.config.page_size)
+        else:
+            raise ValueError("Unknown storage backend: {}".format(backend))
+
+    def close(self):
+        self.cache.clear()
+        self.passwords.close()
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+        if metrics.enabled:
+            metrics.save(self.config.metrics_path)
             
     def create_table(self):
         conn = self.conn
         if conn:
+            metrics.trace_sql(conn)
             try:
                 c = conn.cursor()
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS passwords
-                    (website TEXT, username TEXT, password TEXT, date_created DATE, date_modified DATE)
-                    ''')
+                # WAL lets readers keep working during an export and needs fewer fsyncs per commit.
+                c.execute('PRAGMA journal_mode=WAL')
+                c.execute('PRAGMA synchronous=NORMAL')
+                migrate_table(conn)
                 conn.commit()
                 print("Table created successfully")
             except Exception as e:
@@ -45,21 +87,55 @@ class PasswordManager:
         filepath = self.config.master_key_filepath
         if not os.path.exists(filepath):
             # Checks if master_key_file exists and if doesn't, create it and write the key to it.
+            from cryptography.fernet import Fernet
+            key = Fernet.generate_key()
             with open(filepath, 'wb') as f: 
-                f.write(self.key)
+                f.write(key)
+            self.set_keys([key.decode()])
             print("Master key was created: {}".format(self.config.master_key_filepath))
         else:
-            # If it does exists, load open and read the key.
-            with open(filepath, 'r') as f:
-                self.key = f.read()
-                self.fernet = Fernet(self.key)
+            # If it does exists, load open and read the keys, more than one while a key rotation runs.
+            self.set_keys(read_keys(filepath))
+
+    def set_keys(self, keys):
+        # The first key encrypts, any of them decrypts, see masterkey.
+        self.keys = list(keys)
+        self.key = self.keys[0]
+        self._fernet = None
+
+    def reload_keys(self):
+        # Pick up a key rotation started by another process, returns whether the keys changed.
+        keys = read_keys(self.config.master_key_filepath)
+        if keys == self.keys:
+            return False
+        self.set_keys(keys)
+        return True
        
     
-    def generate_password(self, length=12):
+    def password_policy(self, **overrides):
+        # Password policy from the config, with keyword arguments overriding it
+        from generator import PasswordPolicy
+        settings = {
+            'length': self.config.password_length,
+            'symbols': self.config.password_symbols,
+            'exclude_ambiguous': self.config.password_exclude_ambiguous,
+            'words': self.config.passphrase_words,
+            'wordlist': self.config.wordlist_path or None,
+        }
+        settings.update(overrides)
+        return PasswordPolicy(**settings)
+
+    def generate_password(self, length=None, policy=None):
         # Generate a random password of specified length
-        chars = string.ascii_letters + string.digits + string.punctuation
-        password = ''.join(random.choice(chars) for _ in range(length))
-        return password
+        if policy is None:
+            policy = self.password_policy() if length is None else self.password_policy(length=length)
+        from generator import generate
+        return generate(policy)
+
+    def generate_passwords(self, count, policy=None):
+        # Generate many passwords at once, see generator.generate_many
+        from generator import generate_many
+        return generate_many(count, policy or self.password_policy())
     
     def encrypt_password(self, password):
         # Encrypt a password using the Fernet encryption key
@@ -74,7 +150,56 @@ class PasswordManager:
         if self.config.encryption == False:
             return encrypted_password
         else:
-            return self.fernet.decrypt(encrypted_password.encode()).decode()
+            try:
+                return self.fernet.decrypt(encrypted_password.encode()).decode()
+            except Exception:
+                if not self.reload_keys():
+                    raise
+                return self.fernet.decrypt(encrypted_password.encode()).decode()
+
+    def encrypt_many(self, passwords, workers=None, chunk_size=None):
+        # Encrypt many passwords at once, results keep the input order and failures are reported per item
+        return self._run_batch('encrypt', passwords, workers, chunk_size)
+
+    def decrypt_many(self, encrypted_passwords, workers=None, chunk_size=None):
+        # Decrypt many passwords at once, results keep the input order and failures are reported per item
+        encrypted_passwords = list(encrypted_passwords)
+        result = self._run_batch('decrypt', encrypted_passwords, workers, chunk_size)
+        if result.errors and self.config.encryption != False and self.reload_keys():
+            # Some ciphertexts were made with a key from a rotation in another process.
+            failed = sorted(result.errors)
+            retry = self._run_batch('decrypt', [encrypted_passwords[index] for index in failed], workers, chunk_size)
+            for position, index in enumerate(failed):
+                result.values[index] = retry.values[position]
+                if position in retry.errors:
+                    result.errors[index] = retry.errors[position]
+                else:
+                    del result.errors[index]
+        return result
+
+    def rotate_many(self, encrypted_passwords, workers=None, chunk_size=None):
+        # Re-encrypt many passwords under the newest master key, see masterkey
+        return self._run_batch('rotate', encrypted_passwords, workers, chunk_size)
+
+    def _run_batch(self, operation, values, workers, chunk_size):
+        if self.config.encryption == False:
+            return BatchResult(list(values), {})
+        result = run_batch(operation, self.keys, values,
+                           workers=workers or self.config.crypto_workers,
+                           chunk_size=chunk_size or self.config.crypto_chunk_size,
+                           executor=self.config.crypto_executor)
+        metrics.count('entries.' + operation, len(result.values))
+        return result
+
+    def batches(self, entries=None):
+        # Iterate over the vault, or the given entries, in lists big enough to keep every crypto worker busy.
+        size = self.config.crypto_chunk_size * self.config.crypto_workers
+        entries = iter(self.passwords if entries is None else entries)
+        while True:
+            batch = list(itertools.islice(entries, size))
+            if not batch:
+                return
+            yield batch
 
     def add_password(self, website, username, password=None):
         # Add a password for a given website and username
@@ -82,55 +207,114 @@ class PasswordManager:
         if not password:
             choice = input("You didn't specify a password. Do you want to generate one?(y/n)?: ")
             if choice.lower() == 'y':
-                number = int(input("Enter password length (Default length: 12): "))
-                if number == None or number > 20:
-                    password = self.generate_password(length=number)
-                    encrypted_password = self.encrypt_password(password)
-                else:
-                    password = self.generate_password(length=number)
-                    encrypted_password = self.encrypt_password(password)
+                password = self.generate_password()
+                encrypted_password = self.encrypt_password(password)
             elif choice.lower() == 'n':
                 password = input("Enter a password: ")
                 encrypted_password = self.encrypt_password(password)
         elif password:
             encrypted_password = self.encrypt_password(password)
-        entry = {
-            'website': website,
-            'username': username,
-            'password': encrypted_password,
-            'date_created': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'date_modified': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        self.passwords.append(entry)
+        now = int(time.time())
+        self.passwords.add(Entry(website, username, encrypted_password, now, now))
+        self.changes.touch((website, username))
+
+    def add_passwords(self, items):
+        # Add or update many (website, username, password) items at once, returns (added, updated) entry lists
+        items = list(items)
+        result = self.encrypt_many(password for website, username, password in items)
+        now = int(time.time())
+        added = []
+        updated = []
+        for (website, username, password), encrypted_password in zip(items, result.values):
+            if encrypted_password is None:
+                print(f"Error: Could not encrypt password for {website} ({username}).")
+                continue
+            entry = self.passwords.get(website, username)
+            if entry is None:
+                added.append(Entry(website, username, encrypted_password, now, now))
+            else:
+                self.cache.invalidate((website, username))
+                entry.password = encrypted_password
+                entry.modified = now
+                entry.wrapped = False
+                updated.append(entry)
+            self.changes.touch((website, username))
+        self.passwords.add_many(added + updated)
+        return added, updated
 
     def get_password(self, website, username):
         # Get the password for a given website and username
-        for entry in self.passwords:
-            if entry['website'] == website and entry['username'] == username:
-                encrypted_password = entry['password']
-                return self.decrypt_password(encrypted_password)
-        return None
+        entry = self.passwords.get(website, username)
+        if entry is None:
+            return None
+        key = (website, username)
+        password = self.cache.get(key, entry.password)
+        if password is None:
+            start = time.perf_counter()
+            password = self.decrypt_password(self.unwrap_password(entry))
+            self.cache.record_decrypt(time.perf_counter() - start)
+            self.cache.put(key, entry.password, password)
+        return password
+
+    def unwrap_password(self, entry):
+        # Entries loaded from a legacy JSON file keep the file's extra encryption layer until the
+        # password is first needed, then the unwrapped ciphertext is stored back.
+        if entry.wrapped:
+            entry.password = self.decrypt_password(entry.password)
+            entry.wrapped = False
+            self.passwords.add(entry)
+        return entry.password
+
+    def unwrap_many(self, entries, save=True):
+        # Batch version of unwrap_password, returns the entries that are unwrapped afterwards.
+        # With save=False the unwrapped entries are not stored back, for entries that are not in the vault.
+        wrapped = [entry for entry in entries if entry.wrapped]
+        if wrapped:
+            result = self.decrypt_many(entry.password for entry in wrapped)
+            for index, entry in enumerate(wrapped):
+                if index in result.errors:
+                    print(f"Error: Could not decrypt password for {entry.website} ({entry.username}): {result.errors[index]!r}")
+                else:
+                    entry.password = result.values[index]
+                    entry.wrapped = False
+            if save:
+                self.passwords.add_many(entry for entry in wrapped if not entry.wrapped)
+        return [entry for entry in entries if not entry.wrapped]
+
+    def unwrapped_entries(self, entries=None):
+        # Yield the vault's entries, or the given ones, with their file layer removed.
+        for batch in self.batches(entries):
+            yield from self.unwrap_many(batch, save=entries is None)
+
+    def get_accounts(self, website):
+        # Get all usernames stored for a given website
+        return [entry.username for entry in self.passwords.for_website(website)]
 
     def delete_password(self, website, username):
         # Delete the password for a given website and username
-        for entry in self.passwords:
-            if entry['website'] == website and entry['username'] == username:
-                self.passwords.remove(entry)
-
-    def list_passwords(self):
-        # List all stored passwords
-       for entry in self.passwords:
-            encrypted_password = entry['password']
-            # try:
-            #     decrypted_password = self.decrypt_password(encrypted_password)
-            # except Exception as e:
-            #     print(f"Error: Could not decrypt password for {entry['website']} ({entry['username']}).")
-            #     print(f"  Reason: {str(e)}")
-            #     decrypted_password = None
-            # if decrypted_password:
-            #     print(f"Website: {entry['website']}\nUsername: {entry['username']}\nPassword: {decrypted_password}\nDate created: {entry['date_created']}\nDate modified: {entry['date_modified']}\n")
-            # else:
-            print(f"Website: {entry['website']}\nUsername: {entry['username']}\nPassword: {encrypted_password}\nDate created: {entry['date_created']}\nDate modified: {entry['date_modified']}\n")
+        if self.passwords.remove(website, username) is not None:
+            self.changes.delete((website, username), int(time.time()))
+        self.cache.invalidate((website, username))
+
+    def search(self, text=None, mode='substring', field=None, created=None, modified=None):
+        # Lazy, paginated search results, see search.Query for the arguments and search.SearchResults.
+        from search import Query, SearchResults
+        query = Query(text, mode, field, created, modified, cutoff=self.config.search_fuzzy_cutoff)
+        return SearchResults(self.passwords, query, page_size=self.config.page_size)
+
+    def list_passwords(self, cursor=None, limit=None, results=None):
+        # List stored passwords, or the search results given. With a limit only one page is listed and
+        # the cursor for the next page is returned.
+        if results is None:
+            results = self.passwords
+        if limit is None:
+            entries, next_cursor = results, None
+        else:
+            entries, next_cursor = results.page(cursor, limit)
+        for entry in entries:
+            encrypted_password = entry.password
+            print(f"Website: {entry.website}\nUsername: {entry.username}\nPassword: {encrypted_password}\nDate created: {format_date(entry.created)}\nDate modified: {format_date(entry.modified)}\n")
+        return next_cursor
     
     # def generate_and_add_password(self, website, username):
     #     # Generate a new password and add it for a website and username
@@ -139,103 +323,338 @@ class PasswordManager:
 
     def modify_password(self, website, username, new_password):
         # Modify the password for a given website and username
-        for entry in self.passwords:
-            if entry['website'] == website and entry['username'] == username:
-                encrypted_password = self.encrypt_password(new_password)
-                entry['password'] = encrypted_password
-                entry['date_modified'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def save_to_file(self, filename):
-        # Save passwords to a JSON file
-        encrypted_passwords = []
-        for entry in self.passwords:
-            encrypted_entry = {
-                'website': entry['website'],
-                'username': entry['username'],
-                'password': self.encrypt_password(entry['password']),
-                'date_created': entry['date_created'],
-                'date_modified': entry['date_modified']
-            }
-            encrypted_passwords.append(encrypted_entry)
+        entry = self.passwords.get(website, username)
+        if entry is not None:
+            self.cache.invalidate((website, username))
+            entry.password = self.encrypt_password(new_password)
+            entry.wrapped = False
+            entry.modified = int(time.time())
+            self.passwords.add(entry)
+            self.changes.touch((website, username))
+
+    def changed_entries(self, target):
+        # Entries changed since `target` was last synced, then tombstones of the entries deleted since,
+        # or None when it was never synced. See changes.ChangeTracker.
+        delta = self.changes.delta(target)
+        if delta is None:
+            return None
+        changed, deleted = delta
+        entries = [entry for entry in (self.passwords.get(*key) for key in changed) if entry is not None]
+        return entries, [Tombstone(website, username, date_deleted) for (website, username), date_deleted in deleted.items()]
+
+    def merge(self, records, source=None):
+        # Merge entries, and tombstones of deleted entries, into the vault by key. The side modified or deleted last
+        # wins, the incoming record on a tie. `source` is the vault file or database the records come from, afterwards
+        # only what the vault has and the source lacks is left to sync to it. Returns the keys where the vault won.
+        in_sync = source is not None and (self.changes.is_synced(source) or len(self.passwords) == 0)
+        if in_sync and not set(self.changes.synced) - {source}:
+            # No other target needs these changes, so they aren't recorded.
+            self.changes.synced.clear()
+        # Keys of the source, to find the entries it lacks, unless it held the whole vault before.
+        seen = None if in_sync or source is None else set()
+        kept = {}
+        pending = {}
+        merged = 0
+        for merged, record in enumerate(records, 1):
+            key = (record.website, record.username)
+            if seen is not None:
+                seen.add(key)
+            existing = pending.get(key) or self.passwords.get(*key)
+            if existing is None:
+                # An entry deleted here after the record was written stays deleted.
+                date_deleted = self.changes.date_deleted(key)
+                if date_deleted is not None and date_deleted > record.modified:
+                    kept[key] = date_deleted
+                    continue
+            elif existing.modified > record.modified:
+                kept[key] = None
+                continue
+            elif existing.modified == record.modified and existing.password == record.password:
+                continue
+            kept.pop(key, None)
+            if record.deleted:
+                self.passwords.add_many(pending.values())
+                pending.clear()
+                if existing is not None:
+                    self.passwords.remove(*key)
+                self.changes.delete(key, record.modified)
+            else:
+                pending[key] = record
+                self.changes.touch(key)
+            if existing is not None:
+                self.cache.invalidate(key)
+            # Written in batches, a single transaction each on the SQLite backend.
+            if len(pending) >= self.config.page_size:
+                self.passwords.add_many(pending.values())
+                pending.clear()
+        self.passwords.add_many(pending.values())
+        metrics.count('entries.merged', merged)
+        if source is not None:
+            missing = [] if seen is None else [key for key in ((entry.website, entry.username) for entry in self.passwords)
+                                               if key not in seen]
+            self.changes.mark_synced(source)
+            for key in missing:
+                self.changes.touch(key)
+        # Newer entries and deletions of the vault still have to reach the source.
+        for key, date_deleted in kept.items():
+            if date_deleted is not None:
+                self.changes.delete(key, date_deleted)
+            elif key in self.passwords:
+                self.changes.touch(key)
+        return list(kept)
+
+    def save_to_file(self, filename, overwrite=None):
+        # Save passwords to a vault file. A vault file this vault was loaded from or saved to only gets the entries
+        # changed and deleted since then appended, unless superseded records and tombstones would then make up more
+        # than vault_compact_ratio of it, and it is compacted instead. Otherwise the records are streamed to a new file
+        # that atomically replaces it, and an existing file is only overwritten after asking, unless overwrite is given
         filepath = os.path.join(self.config.save_password_dir, filename)
-        if os.path.exists(filepath):
+        target = os.path.abspath(filepath)
+        version = self.changes.version
+        delta = self.changed_entries(target)
+        file_version = vaultfile.version(filepath) if delta is not None and os.path.exists(filepath) else None
+        if file_version == vaultfile.VERSION:
+            entries, tombstones = delta
+            records = self.file_records.get(target)
+            if records is not None:
+                records += len(entries) + len(tombstones)
+            if records is None or records - len(self.passwords) <= self.config.vault_compact_ratio * records:
+                if entries or tombstones:
+                    vaultfile.append_records(filepath, itertools.chain(self.unwrapped_entries(entries), tombstones))
+                    metrics.count('entries.saved', len(entries) + len(tombstones))
+                if records is not None:
+                    self.file_records[target] = records
+                self.changes.mark_synced(target, version)
+                return
+            overwrite = True
+        elif file_version is not None:
+            # A synced vault file of an older version is rewritten in the current one.
+            overwrite = True
+        if os.path.exists(filepath) and overwrite is None:
             choice = input("This file already exists. Do you want to overwrite it (y/n)?: ")
-            if choice.lower() == 'y':
-                with open(filepath, 'w') as f:
-                    json.dump(encrypted_passwords, f, indent=4)
-            elif choice.lower() == 'n':
+            if choice.lower() != 'y':
                 print("If you want to save to a different file, try again with a different name.")
-        else:
-            with open(filepath, 'w') as f:
-                json.dump(encrypted_passwords, f, indent=4)
+                return
+        elif os.path.exists(filepath) and not overwrite:
+            return
+        vaultfile.write_records(filepath, self.unwrapped_entries())
+        metrics.count('entries.saved', len(self.passwords))
+        self.file_records[target] = len(self.passwords)
+        self.changes.mark_synced(target, version)
+
+    def append_to_file(self, filename, entries):
+        # Append entries to a vault file without rewriting it
+        filepath = os.path.join(self.config.save_password_dir, filename)
+        vaultfile.append_records(filepath, self.unwrapped_entries(entries))
 
     def load_from_file(self, filename):
-        # Load passwords from a JSON file
+        # Merge the passwords of a vault file, or of a JSON file written by older versions, into the vault
         filepath = os.path.join(self.config.save_password_dir, filename)
         if os.path.exists(filepath):
-            with open(filepath, 'r') as f:
-                encrypted_passwords = json.load(f)
-            self.passwords.clear()
-            for entry in encrypted_passwords:
-                decrypted_password = self.decrypt_password(entry['password'])
-                password = {
-                    'website': entry['website'],
-                    'username': entry['username'],
-                    'password': decrypted_password,
-                    'date_created': entry['date_created'],
-                    'date_modified': entry['date_modified']
-                }
-                self.passwords.append(password)
+            target = os.path.abspath(filepath)
+
+            def counted(records):
+                for number, record in enumerate(records, 1):
+                    self.file_records[target] = number
+                    yield record
+
+            # Records are read lazily and passwords are decrypted lazily, see unwrap_password.
+            self.file_records[target] = 0
+            self.merge(counted(vaultfile.read_records(filepath, tombstones=True)), source=target)
         else:
             print("Error: File not found.")
+
     def initialize_db(self):
          # Initializing Database
         self.create_table()
         print("New Database was initalized.")
         print("New Database created.")
 
-    def export_to_database(self, filepath=None):
+    def export_to_database(self, filepath=None, entries=None, tombstones=None):
         # If the filepath is None, then we use the existing db. Else, we use connect to the filepath.
+        # Entries are upserted in a single transaction, returns (inserted, updated) row counts. Without entries only the
+        # changes since the last sync with this database are written, deleted entries included, or the whole vault
+        # the first time. With entries, `tombstones` is a dict filled while they are read, deleted after them.
+        # Rows modified after the incoming entry, or its deletion, are kept.
+        import sqlite3
         if filepath is not None:
             if os.path.exists(filepath):
                 self.conn = sqlite3.connect(filepath)
-                
+                self.create_table()
             else:
                 print(f"Error: {filepath} does not exist")
                 return
         else:
             self.conn = sqlite3.connect(self.config.default_db_path)
             self.initialize_db()
-        for entry in self.passwords:
-            query = "INSERT INTO passwords (website, username, password, date_created, date_modified) VALUES (?, ?, ?, ?, ?)"
-            values = (entry['website'], entry['username'], self.encrypt_password(entry['password']), entry['date_created'], entry['date_modified'])
-            try:
+        target = os.path.abspath(filepath or self.config.default_db_path)
+        version = self.changes.version
+        # New rows are inserted first, then the rows that were already there are updated, unless they are
+        # newer or unchanged. The counts come from the changes each pass made, not from counting the table.
+        insert = """
+            INSERT INTO passwords (website, username, password, date_created, date_modified, wrapped) VALUES (?, ?, ?, ?, ?, 0)
+            ON CONFLICT (website, username) DO NOTHING
+            """
+        update = """
+            UPDATE passwords SET password = ?, date_created = ?, date_modified = ?, wrapped = 0
+            WHERE website = ? AND username = ? AND date_modified <= ?
+            AND NOT (password = ? AND date_created = ? AND date_modified = ? AND wrapped = 0)
+            """
+        try:
+            with self.conn:
                 c = self.conn.cursor()
-                c.execute(query, values)
-                self.conn.commit()
-            except Exception as e:
-                print(e)
+                tracked = entries is None
+                if tracked:
+                    tombstones = []
+                # An emptied database gets the whole vault again.
+                empty = c.execute("SELECT 1 FROM passwords LIMIT 1").fetchone() is None
+                delta = self.changed_entries(target) if tracked and not empty else None
+                if delta is not None:
+                    entries, tombstones = delta
+                elif tracked:
+                    # Rows of entries deleted here may predate the last export.
+                    tombstones = [Tombstone(website, username, date_deleted)
+                                  for (website, username), date_deleted in self.changes.deleted().items()]
+                # Stored passwords are already encrypted, so they are written as-is once unwrapped.
+                # Dates are stored as text, which sorts in date order.
+                rows = ((entry.website, entry.username, entry.password, format_date(entry.created), format_date(entry.modified))
+                        for entry in self.unwrapped_entries(entries))
+                inserted = updated = 0
+                while True:
+                    chunk = list(itertools.islice(rows, self.config.page_size))
+                    if not chunk:
+                        break
+                    changes = self.conn.total_changes
+                    c.executemany(insert, chunk)
+                    inserted += self.conn.total_changes - changes
+                    changes = self.conn.total_changes
+                    c.executemany(update, ((password, created, modified, website, username, modified, password, created, modified)
+                                           for website, username, password, created, modified in chunk))
+                    updated += self.conn.total_changes - changes
+                if not tracked and tombstones is not None:
+                    tombstones = list(tombstones.values())
+                deleted = 0
+                if tombstones:
+                    c.executemany("DELETE FROM passwords WHERE website = ? AND username = ? AND date_modified <= ?",
+                                  ((entry.website, entry.username, format_date(entry.modified)) for entry in tombstones))
+                    deleted = max(c.rowcount, 0)
+        except Exception as e:
+            print(e)
+            return
+        if tracked:
+            self.changes.mark_synced(target, version)
+        metrics.count('entries.exported', inserted + updated + deleted)
+        print(f"Exported {inserted} new, {updated} updated and {deleted} deleted entries.")
+        return inserted, updated
+
+    def database_records(self, file):
+        # Stream the entries stored in a database file.
+        import sqlite3
+        conn = sqlite3.connect(file)
+        metrics.trace_sql(conn)
+        try:
+            # Rows of databases written by the first version carry an extra encryption layer, see wrapped_column.
+            query = "SELECT website, username, password, date_created, date_modified, {} FROM passwords".format(wrapped_column(conn))
+            for row in conn.execute(query):
+                yield Entry(row[0], row[1], row[2], parse_date(row[3]), parse_date(row[4]), bool(row[5]))
+        finally:
+            conn.close()
 
     def load_from_database(self, file):
         if file:
-            with sqlite3.connect(file) as self.conn:
-                conn = self.conn
-                query = "SELECT website, username, password, date_created, date_modified FROM passwords"
-                try:
-                    c = conn.cursor()
-                    c.execute(query)
-                    rows = c.fetchall()
-                    if len(rows) > 0:
-                        for row in rows:
-                            password = {
-                                'website': row[0],
-                                'username': row[1],
-                                'password': row[2],
-                                'date_created': row[3],
-                                'date_modified': row[4],
-                            }
-                            self.passwords.append(password)
-                except Exception as e:
-                    print(e)
+            try:
+                # Rows are streamed from the cursor instead of fetched all at once, and merged by key.
+                self.merge(self.database_records(file), source=os.path.abspath(file))
+            except Exception as e:
+                print(e)
+        else:
+            print(list(self.passwords))
+
+    def index_key(self):
+        return binvault.index_key(self.key)
+
+    def export_to_binary(self, filepath, entries=None):
+        # Write the vault, or the given entries, to a memory-mappable binary vault file. Returns the number of entries.
+        return binvault.write_vault(filepath, self.unwrapped_entries(entries), self.index_key(), self.encrypt_many)
+
+    def open_binary(self, filepath):
+        # Open a binary vault for random access, see binvault.BinaryVault.
+        return binvault.BinaryVault(filepath, self.index_key(), self.decrypt_password)
+
+    def load_from_binary(self, filepath):
+        # Merge every entry of a binary vault into this password manager.
+        with self.open_binary(filepath) as vault:
+            self.merge(vault)
+
+    def get_password_from_binary(self, filepath, website, username):
+        # Get a password straight from a binary vault, only the index pages and one record are read.
+        with self.open_binary(filepath) as vault:
+            entry = vault.get(website, username)
+            # A vault not yet rewritten by a key rotation is indexed with an older key.
+            for key in self.keys[1:]:
+                if entry is not None:
+                    break
+                vault.hash_key = binvault.index_key(key)
+                entry = vault.get(website, username)
+        if entry is None:
+            return None
+        return self.decrypt_password(entry.password)
+
+    def vault_records(self, source, tombstones=False, deleted=None):
+        # Stream the entries of a vault file, its format is picked by the extension: .json/.ndjson, .db or .pmv.
+        # With tombstones, those of an NDJSON file are included, for merge. See vaultfile.read_records for `deleted`.
+        source_format = os.path.splitext(source)[1].lower()
+        if source_format in ('.json', '.ndjson'):
+            yield from vaultfile.read_records(source, tombstones, deleted)
+        elif source_format == '.db':
+            yield from self.database_records(source)
+        elif source_format == binvault.EXTENSION:
+            with self.open_binary(source) as vault:
+                yield from vault
         else:
-            print(self.passwords)
\ No newline at end of file
+            raise ValueError("Unsupported vault format: {}".format(source))
+
+    def convert_vault(self, source, destination):
+        # Stream entries from one vault file into another without loading them into this password manager.
+        # The format of each path is picked by its extension: .json/.ndjson, .db or .pmv.
+        destination_format = os.path.splitext(destination)[1].lower()
+        entries = self.vault_records(source)
+        if destination_format in ('.json', '.ndjson'):
+            vaultfile.write_records(destination, self.unwrapped_entries(entries))
+        elif destination_format == '.db':
+            if not os.path.exists(destination):
+                import sqlite3
+                sqlite3.connect(destination).close()
+            # Entries an NDJSON source deletes are deleted from the database too.
+            deleted = {}
+            self.export_to_database(destination, self.vault_records(source, deleted=deleted), deleted)
+        elif destination_format == binvault.EXTENSION:
+            self.export_to_binary(destination, entries)
+        else:
+            raise ValueError("Unsupported vault format: {}".format(destination))
+
+    def audit(self, breach_list=None, progress=True):
+        # Find reused and breached passwords, only entries modified since the last audit are rechecked.
+        # progress is a callback taking (done, total), True prints the progress and False disables it.
+        from audit import audit_vault, print_progress
+        if progress is True:
+            progress = print_progress
+        breach_list = breach_list or self.config.breach_list_path or None
+        return audit_vault(self, self.config.audit_state_path, breach_list, progress)
+
+    def rotate_key(self, vaults=None, retire=True, progress=True):
+        # Switch to a new master key and re-encrypt the vault under it in chunks, then retire the old key.
+        # Besides the entries in memory or the SQLite backend and the vault files in save_password_dir and
+        # default_db_dir, `vaults` lists the .db, .ndjson/.json and .pmv files to re-encrypt, by default the
+        # ones this vault was synced with. A file left out needs a retired key from retired_keys_filepath to
+        # be decrypted. An interrupted rotation resumes when this is called again.
+        # Audit results are keyed by the master key, so the next audit checks every entry again.
+        from masterkey import rotate, print_progress
+        if progress is True:
+            progress = print_progress
+        if vaults is None:
+            vaults = list(self.changes.synced)
+        if self.config.storage_backend == 'sqlite':
+            vaults = [self.config.storage_db_path] + list(vaults)
+        self.cache.clear()
+        return rotate(self, self.config.key_rotation_state_path, vaults, retire, progress or None)
@@ -0,0 +1,355 @@
+import bisect
+import difflib
+import heapq
+import itertools
+
+# Search over the entries of a vault: by website and username, as a prefix, a
+# substring or fuzzily, and by ranges of creation and modification dates.
+#
+# The in-memory store keeps a SearchIndex, built on its first search and then
+# updated on every add and remove. Websites and usernames are indexed as
+# lowercase terms: a sorted list of terms answers prefix searches by binary
+# search, and a trigram index, mapping every three-character slice to the terms
+# holding it, narrows substring and fuzzy searches down to a few candidates.
+# Dates are sorted lists of (date, key) cut with binary search. The SQLite store
+# answers the same queries in SQL, see SQLiteEntryStore.search.
+FIELDS = ('website', 'username')
+MODES = ('substring', 'prefix', 'fuzzy')
+GRAM_SIZE = 3
+# Terms scored per field by a fuzzy search, those sharing the most trigrams with the query.
+FUZZY_CANDIDATES = 1000
+# Below this many entries per add_many the sorted lists are updated in place, above they are re-sorted on the next search.
+INSERT_LIMIT = 64
+
+
+def grams(term, padded=True):
+    # Trigrams of a term. Padding the start and end gives short terms and word ends
+    # trigrams of their own, which fuzzy matching needs. Substring searches look up the
+    # unpadded trigrams of the query, the padded ones of the term include them.
+    if padded:
+        term = '  ' + term + ' '
+    return {term[i:i + GRAM_SIZE] for i in range(len(term) - GRAM_SIZE + 1)}
+
+
+def parts(term):
+    # The term and the words in it, so 'gihtub' is close to 'github.com'.
+    for separator in '@-_':
+        term = term.replace(separator, '.')
+    return [term] + [part for part in term.split('.') if part]
+
+
+def similarity(text, term, cutoff=0.0):
+    # How close a lowercase query is to a lowercase term, from 0 to 1, or 0 when below cutoff.
+    # Substrings score 1. The cheap upper bounds of difflib rule most terms out before ratio().
+    if text in term:
+        return 1.0
+    best = 0.0
+    for part in parts(term):
+        matcher = difflib.SequenceMatcher(None, part, text)
+        if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+            ratio = matcher.ratio()
+            if ratio >= cutoff and ratio > best:
+                best = ratio
+    return best
+
+
+def in_range(value, bounds):
+    # bounds is (start, end), the start included and the end excluded, either may be None.
+    if bounds is None:
+        return True
+    start, end = bounds
+    return (start is None or value >= start) and (end is None or value < end)
+
+
+class Query:
+    # What to search for. `text` is matched case-insensitively against the website and the
+    # username, or only `field`, as a substring, a prefix or fuzzily (`mode`). Fuzzy matches
+    # score at least `cutoff`, see similarity. `created` and `modified` are (start, end) ranges
+    # of epoch seconds, see in_range.
+    def __init__(self, text=None, mode='substring', field=None, created=None, modified=None, cutoff=0.6):
+        if mode not in MODES:
+            raise ValueError("Unknown search mode: {}".format(mode))
+        if field is not None and field not in FIELDS:
+            raise ValueError("Unknown search field: {}".format(field))
+        self.text = text.lower() if text else None
+        self.mode = mode
+        self.fields = FIELDS if field is None else (field,)
+        self.created = created
+        self.modified = modified
+        self.cutoff = cutoff
+
+    def match_dates(self, entry):
+        return in_range(entry.created, self.created) and in_range(entry.modified, self.modified)
+
+
+class SearchResults:
+    # Lazy results of a search on a store. Iterating runs the search only as far as it is
+    # consumed. page() returns one page and the cursor of the next one, the number of
+    # results before it, or None after the last page.
+    def __init__(self, store, query, page_size=500):
+        self.store = store
+        self.query = query
+        self.page_size = page_size
+
+    def __iter__(self):
+        return iter(self.store.search(self.query))
+
+    def page(self, cursor=None, limit=None):
+        start = cursor or 0
+        limit = limit or self.page_size
+        entries = list(itertools.islice(self.store.search(self.query, start), limit + 1))
+        next_cursor = start + limit if len(entries) > limit else None
+        return entries[:limit], next_cursor
+
+
+def _add_key(keys, term, key):
+    # A term found in one entry maps to its key, in more to a set of keys, which saves
+    # a set per username since most usernames are found in a single entry.
+    found = keys.get(term)
+    if found is None:
+        keys[term] = key
+        return True
+    if isinstance(found, set):
+        found.add(key)
+    elif found != key:
+        keys[term] = {found, key}
+    return False
+
+
+def _remove_key(keys, term, key):
+    # Returns whether the term is gone.
+    found = keys.get(term)
+    if isinstance(found, set):
+        found.discard(key)
+        if len(found) == 1:
+            keys[term] = next(iter(found))
+        return False
+    if found == key:
+        del keys[term]
+        return True
+    return False
+
+
+class SearchIndex:
+    # Search indexes over the entries of an EntryStore, per field: `keys` maps a term to
+    # the key or keys of its entries, `terms` holds the terms sorted and `grams` maps a
+    # trigram to the terms holding it, built on the first substring or fuzzy search of
+    # the field since it is the costliest. `dates` maps a key to the (created, modified)
+    # it is indexed under in the sorted `created` and `modified` lists.
+    def __init__(self, entries=()):
+        self.keys = {field: {} for field in FIELDS}
+        self.terms = {field: [] for field in FIELDS}
+        self.grams = {field: None for field in FIELDS}
+        self.dates = {}
+        self.created = []
+        self.modified = []
+        # False while items were appended to the sorted lists since they were last sorted.
+        self.sorted = True
+        self.add_many(entries)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _sorted_lists(self):
+        return [self.created, self.modified] + [self.terms[field] for field in FIELDS]
+
+    def _sort(self):
+        if not self.sorted:
+            for items in self._sorted_lists():
+                items.sort()
+            self.sorted = True
+
+    def _delete(self, items, item):
+        index = bisect.bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            del items[index]
+
+    def add(self, entry):
+        self.add_many([entry])
+
+    def _add_grams(self, field_grams, term):
+        for gram in grams(term):
+            holders = field_grams.get(gram)
+            if holders is None:
+                field_grams[gram] = {term}
+            else:
+                holders.add(term)
+
+    def _add_term(self, field, term, new_terms):
+        new_terms.append(term)
+        if self.grams[field] is not None:
+            self._add_grams(self.grams[field], term)
+
+    def _field_grams(self, field):
+        if self.grams[field] is None:
+            field_grams = {}
+            for term in self.keys[field]:
+                self._add_grams(field_grams, term)
+            self.grams[field] = field_grams
+        return self.grams[field]
+
+    def add_many(self, entries):
+        # Index new entries and reindex the dates of changed ones. A few entries are
+        # inserted in place, more are appended and the lists sorted on the next search.
+        # A key found twice in the batch is indexed as its last entry, like the store keeps it.
+        entries = list({(entry.website, entry.username): entry for entry in entries}.values())
+        lists = self._sorted_lists()
+        # Items to add to and remove from each of the sorted lists, in the same order.
+        added = new_created, new_modified, new_websites, new_usernames = [], [], [], []
+        stale = stale_created, stale_modified, _, _ = set(), set(), set(), set()
+        website_keys, username_keys = self.keys['website'], self.keys['username']
+        for entry in entries:
+            key = (entry.website, entry.username)
+            created, modified = dates = (entry.created, entry.modified)
+            indexed = self.dates.get(key)
+            if indexed is None:
+                website, username = key[0].lower(), key[1].lower()
+                if _add_key(website_keys, website, key):
+                    self._add_term('website', website, new_websites)
+                if _add_key(username_keys, username, key):
+                    self._add_term('username', username, new_usernames)
+                new_created.append((created, key))
+                new_modified.append((modified, key))
+            elif indexed == dates:
+                continue
+            else:
+                if indexed[0] != created:
+                    stale_created.add((indexed[0], key))
+                    new_created.append((created, key))
+                if indexed[1] != modified:
+                    stale_modified.add((indexed[1], key))
+                    new_modified.append((modified, key))
+            self.dates[key] = dates
+        in_place = self.sorted and len(entries) <= INSERT_LIMIT
+        for items, new, old in zip(lists, added, stale):
+            if in_place:
+                for item in old:
+                    self._delete(items, item)
+                for item in new:
+                    bisect.insort(items, item)
+            else:
+                if old:
+                    items[:] = [item for item in items if item not in old]
+                if new:
+                    items.extend(new)
+                    self.sorted = False
+
+    def remove(self, website, username):
+        key = (website, username)
+        indexed = self.dates.pop(key, None)
+        if indexed is None:
+            return
+        self._sort()
+        self._delete(self.created, (indexed[0], key))
+        self._delete(self.modified, (indexed[1], key))
+        for field, term in zip(FIELDS, key):
+            term = term.lower()
+            if _remove_key(self.keys[field], term, key):
+                self._delete(self.terms[field], term)
+                field_grams = self.grams[field]
+                if field_grams is not None:
+                    for gram in grams(term):
+                        holders = field_grams[gram]
+                        holders.discard(term)
+                        if not holders:
+                            del field_grams[gram]
+
+    def clear(self):
+        self.__init__()
+
+    def _term_keys(self, field, term):
+        found = self.keys[field].get(term)
+        if found is None:
+            return []
+        if isinstance(found, set):
+            return sorted(found)
+        return [found]
+
+    def _prefix_terms(self, field, text):
+        # Terms starting with text, in order.
+        terms = self.terms[field]
+        index = bisect.bisect_left(terms, text)
+        while index < len(terms) and terms[index].startswith(text):
+            yield terms[index]
+            index += 1
+
+    def _candidates(self, field, text):
+        # Terms holding every trigram of text, or every term when text is too short to have one.
+        query_grams = grams(text, padded=False)
+        if not query_grams:
+            return self.keys[field]
+        field_grams = self._field_grams(field)
+        postings = sorted((field_grams.get(gram, ()) for gram in query_grams), key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(posting)
+        return found
+
+    def _substring_terms(self, field, text):
+        return sorted(term for term in self._candidates(field, text) if text in term)
+
+    def _fuzzy_terms(self, field, text, cutoff):
+        # (score, term) of the close terms, best first. Only the terms sharing the most
+        # trigrams with text are scored, trigrams in many terms are only counted when
+        # text has no rarer ones.
+        field_grams = self._field_grams(field)
+        postings = sorted((field_grams.get(gram, ()) for gram in grams(text)), key=len)
+        common = max(FUZZY_CANDIDATES, len(self.keys[field]) // 20)
+        counts = {}
+        for index, posting in enumerate(postings):
+            if index and len(posting) > common:
+                break
+            for term in posting:
+                counts[term] = counts.get(term, 0) + 1
+        candidates = heapq.nlargest(FUZZY_CANDIDATES, counts, key=counts.get)
+        scored = [(similarity(text, term, cutoff), term) for term in candidates]
+        return sorted(((score, term) for score, term in scored if score and score >= cutoff), key=lambda item: (-item[0], item[1]))
+
+    def _text_keys(self, query):
+        # Keys of the entries whose terms match, by term: in order for prefix and substring
+        # searches, best match first for fuzzy ones. An entry matching on both fields comes once.
+        text = query.text
+        if query.mode == 'prefix':
+            terms = heapq.merge(*[zip(self._prefix_terms(field, text), itertools.repeat(field)) for field in query.fields])
+        elif query.mode == 'substring':
+            terms = heapq.merge(*[zip(self._substring_terms(field, text), itertools.repeat(field)) for field in query.fields])
+        else:
+            terms = sorted(((score, term, field) for field in query.fields
+                            for score, term in self._fuzzy_terms(field, text, query.cutoff)),
+                           key=lambda item: (-item[0], item[1]))
+            terms = ((term, field) for score, term, field in terms)
+        seen = set() if len(query.fields) > 1 else None
+        for term, field in terms:
+            for key in self._term_keys(field, term):
+                if seen is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield key
+
+    def _date_keys(self, items, bounds):
+        # Keys in a date range, oldest first.
+        start, end = bounds
+        low = 0 if start is None else bisect.bisect_left(items, (start,))
+        high = len(items) if end is None else bisect.bisect_left(items, (end,))
+        for index in range(low, high):
+            yield items[index][1]
+
+    def search(self, query, get):
+        # Lazily yield the entries matching query, looked up with get(website, username).
+        # Without text, the entries in the date range come oldest first.
+        self._sort()
+        if query.text:
+            keys = self._text_keys(query)
+        elif query.modified is not None:
+            keys = self._date_keys(self.modified, query.modified)
+        elif query.created is not None:
+            keys = self._date_keys(self.created, query.created)
+        else:
+            keys = (key for date, key in self.created)
+        for key in keys:
+            entry = get(*key)
+            if entry is not None and query.match_dates(entry):
+                yield entry
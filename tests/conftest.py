@@ -0,0 +1,41 @@
+import os
+import sys
+import contextlib
+import io
+
+import pytest
+
+# The modules live at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_config(directory, **settings):
+    config_file = os.path.join(directory, 'config.ini')
+    with open(config_file, 'w') as f:
+        f.write('[DEFAULT]\napp_file_path = {}\n'.format(directory))
+        for name, value in settings.items():
+            f.write('{} = {}\n'.format(name, value))
+    return config_file
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    # Small crypto batches, so rotations checkpoint after every few entries.
+    return write_config(str(tmp_path), crypto_workers=1, crypto_chunk_size=2)
+
+
+@pytest.fixture
+def make_manager(config_file):
+    # A PasswordManager on the test config, its status messages silenced.
+    from passmanager import PasswordManager
+    managers = []
+
+    def make():
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager = PasswordManager(config_file)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.close()
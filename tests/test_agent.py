@@ -0,0 +1,132 @@
+import os
+import json
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from agent import Agent, AgentClient, AgentError
+from entries import RWLock
+
+
+def hold(lock, mode, acquired, release):
+    # Takes the lock in a thread, records when it got it and keeps it until release is set.
+    def run():
+        with getattr(lock, mode)():
+            acquired.append(mode)
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def released():
+    event = threading.Event()
+    event.set()
+    return event
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def test_readers_wait_for_writer():
+    lock = RWLock()
+    acquired, release = [], threading.Event()
+    writer = hold(lock, 'write', acquired, release)
+    assert wait_for(lambda: acquired == ['write'])
+
+    reader = hold(lock, 'read', acquired, released())
+    threading.Event().wait(0.1)
+    assert acquired == ['write']
+
+    release.set()
+    writer.join(5)
+    reader.join(5)
+    assert acquired == ['write', 'read']
+
+
+def test_readers_share_and_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    acquired, release_first, release_writer = [], threading.Event(), threading.Event()
+    first = hold(lock, 'read', acquired, release_first)
+    second = hold(lock, 'read', acquired, release_first)
+    assert wait_for(lambda: acquired == ['read', 'read'])
+
+    writer = hold(lock, 'write', acquired, release_writer)
+    assert wait_for(lambda: lock.waiting_writers == 1)
+    late = hold(lock, 'read', acquired, released())
+    threading.Event().wait(0.1)
+    assert acquired == ['read', 'read']
+
+    # The writer goes first once the readers are done, the late reader after it.
+    release_first.set()
+    assert wait_for(lambda: acquired == ['read', 'read', 'write'])
+    threading.Event().wait(0.1)
+    assert acquired == ['read', 'read', 'write']
+    release_writer.set()
+    for thread in (first, second, writer, late):
+        thread.join(5)
+    assert acquired == ['read', 'read', 'write', 'read']
+
+
+@pytest.fixture
+def agent(config_file, tmp_path):
+    # An agent serving the test vault from a thread, stopped at the end of the test.
+    agent = Agent(config_file, socket_path=str(tmp_path / 'agent.sock'), idle_timeout=0, workers=4)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(agent.serve())
+    thread = threading.Thread(target=loop.run_until_complete, args=(asyncio.wait([task]),))
+    thread.start()
+    assert wait_for(lambda: os.path.exists(agent.socket_path))
+    yield agent
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+    loop.close()
+
+
+def test_agent_protocol(agent):
+    with AgentClient(agent.socket_path, timeout=5) as client:
+        assert client.request('ping') == 'pong'
+        assert client.add('a.com', 'alice', 'secret') == 'secret'
+        assert client.get('a.com', 'alice') == 'secret'
+        assert client.get('a.com', 'nobody') is None
+        with pytest.raises(AgentError):
+            client.request('unknown')
+
+        # Pipelined responses come back matched to their requests.
+        keys = [('a.com', 'alice'), ('b.com', 'bob'), ('a.com', 'alice')]
+        assert client.get_many(keys) == ['secret', None, 'secret']
+        entries, cursor = client.search('a.com')
+        assert [(entry['website'], entry['username']) for entry in entries] == [('a.com', 'alice')]
+        assert client.delete('a.com', 'alice') is True
+        assert client.get('a.com', 'alice') is None
+
+        assert client.request('lock') is True
+        with pytest.raises(AgentError):
+            client.get('a.com', 'alice')
+        assert client.request('unlock') is True
+
+
+def test_agent_answers_malformed_requests(agent):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(agent.socket_path)
+        f = sock.makefile('rwb')
+        f.write(b'not json\n[1, 2]\n{"id": 3, "op": "get"}\n{"id": 4, "op": "ping"}\n')
+        f.flush()
+        responses = {}
+        for _ in range(4):
+            response = json.loads(f.readline())
+            responses.setdefault(response['id'], []).append(response)
+        f.close()
+
+    assert [response['ok'] for response in responses[None]] == [False, False]
+    assert responses[3][0]['ok'] is False
+    assert responses[4][0] == {'id': 4, 'ok': True, 'result': 'pong'}
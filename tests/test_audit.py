@@ -0,0 +1,70 @@
+import hashlib
+
+import pytest
+
+from audit import BreachList
+
+PASSWORDS = ['password{}'.format(i) for i in range(50)]
+
+
+def sha1(password):
+    return hashlib.sha1(password.encode()).hexdigest().upper()
+
+
+def counts():
+    # Breach counts of different widths, so the lines are of different lengths.
+    return {sha1(password): 10 ** (i % 6) for i, password in enumerate(PASSWORDS)}
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('trailing', [True, False])
+def test_sorted_file(tmp_path, newline, trailing):
+    lines = ['{}:{}'.format(digest, count) for digest, count in sorted(counts().items())]
+    path = tmp_path / 'breaches.txt'
+    path.write_bytes((newline.join(lines) + (newline if trailing else '')).encode())
+
+    with BreachList(str(path)) as breaches:
+        for password in PASSWORDS:
+            assert breaches.count(password) == counts()[sha1(password)]
+        for password in ['not breached', '', 'password50']:
+            assert breaches.count(password) == 0
+
+
+def test_edges_and_lines_without_count(tmp_path):
+    digests = sorted(counts())
+    # The first and last lines are the edges of the search, a line may leave out its count.
+    lines = [digests[0], '{}:7'.format(digests[1])] + ['{}:2'.format(digest) for digest in digests[2:-1]] + [digests[-1].lower()]
+    path = tmp_path / 'breaches.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    by_digest = {sha1(password): password for password in PASSWORDS}
+
+    with BreachList(str(path)) as breaches:
+        assert breaches.count(by_digest[digests[0]]) == 1
+        assert breaches.count(by_digest[digests[1]]) == 7
+        assert breaches.count(by_digest[digests[-1]]) == 1
+        assert breaches.count(by_digest[digests[2]]) == 2
+
+
+def test_single_line(tmp_path):
+    path = tmp_path / 'breaches.txt'
+    path.write_text('{}:3\n'.format(sha1('hunter2')))
+
+    with BreachList(str(path)) as breaches:
+        assert breaches.count('hunter2') == 3
+        assert breaches.count('hunter3') == 0
+
+
+def test_range_directory(tmp_path):
+    ranges = {}
+    for digest, count in counts().items():
+        ranges.setdefault(digest[:5], []).append('{}:{}'.format(digest[5:], count))
+    for prefix, lines in ranges.items():
+        (tmp_path / (prefix + '.txt')).write_text('\r\n'.join(sorted(lines)) + '\r\n')
+    # An empty range file holds no breaches.
+    (tmp_path / (sha1('empty')[:5] + '.txt')).write_text('')
+
+    with BreachList(str(tmp_path)) as breaches:
+        for password in PASSWORDS:
+            assert breaches.count(password) == counts()[sha1(password)]
+        assert breaches.count('empty') == 0
+        assert breaches.count('not breached') == 0
@@ -0,0 +1,41 @@
+import types
+
+import binvault
+from binvault import BinaryVault, write_vault
+from entries import Entry
+
+HASH_KEY = binvault.index_key('test key')
+
+
+def encrypt_many(payloads):
+    # Stores the records in the clear, the tests only look at the layout.
+    return types.SimpleNamespace(values=list(payloads))
+
+
+def decrypt(payload):
+    return payload
+
+
+def test_repeated_key_returns_last_record(tmp_path):
+    path = str(tmp_path / 'vault.pmv')
+    entries = [Entry('a.com', 'alice', 'first', 1, 1), Entry('b.com', 'bob', 'other', 1, 1),
+               Entry('a.com', 'alice', 'second', 1, 2)]
+
+    assert write_vault(path, entries, HASH_KEY, encrypt_many) == 2
+
+    with BinaryVault(path, HASH_KEY, decrypt) as vault:
+        assert len(vault) == 2
+        assert vault.get('a.com', 'alice').password == 'second'
+        assert vault.get('b.com', 'bob').password == 'other'
+        assert vault.get('c.com', 'carol') is None
+
+
+def test_colliding_hash_does_not_return_another_key(tmp_path, monkeypatch):
+    path = str(tmp_path / 'vault.pmv')
+    # Every key truncates to the same hash, as two keys could by chance.
+    monkeypatch.setattr(binvault, 'key_digest', lambda hash_key, website, username: bytes(binvault.DIGEST_SIZE))
+    write_vault(path, [Entry('a.com', 'alice', 'secret', 1, 1)], HASH_KEY, encrypt_many)
+
+    with BinaryVault(path, HASH_KEY, decrypt) as vault:
+        assert vault.get('a.com', 'alice').password == 'secret'
+        assert vault.get('a.com', 'mallory') is None
@@ -0,0 +1,79 @@
+import cache
+from cache import PlaintextCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_needs_the_same_ciphertext():
+    plaintexts = PlaintextCache(maxsize=4, ttl=60)
+    plaintexts.put('a', 'token1', 'secret')
+
+    assert plaintexts.get('a', 'token1') == 'secret'
+    # The entry was re-encrypted since, the cached value is stale.
+    assert plaintexts.get('a', 'token2') is None
+    assert len(plaintexts) == 0
+    assert plaintexts.stats()['hits'] == 1 and plaintexts.stats()['misses'] == 1
+
+
+def test_values_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    plaintexts = PlaintextCache(maxsize=4, ttl=10)
+    plaintexts.put('a', 'token', 'secret')
+
+    clock.now += 9
+    assert plaintexts.get('a', 'token') == 'secret'
+    clock.now += 2
+    assert plaintexts.get('a', 'token') is None
+    assert len(plaintexts) == 0
+
+
+def test_expired_values_are_dropped_on_put(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    plaintexts = PlaintextCache(maxsize=4, ttl=10)
+    plaintexts.put('a', 'token', 'old')
+    clock.now += 11
+    plaintexts.put('b', 'token', 'new')
+
+    assert list(plaintexts.items) == ['b']
+    assert plaintexts.stats()['evictions'] == 1
+
+
+def test_least_recently_used_is_evicted():
+    plaintexts = PlaintextCache(maxsize=2, ttl=60)
+    plaintexts.put('a', 'token', 'first')
+    plaintexts.put('b', 'token', 'second')
+    plaintexts.get('a', 'token')
+    plaintexts.put('c', 'token', 'third')
+
+    assert plaintexts.get('b', 'token') is None
+    assert plaintexts.get('a', 'token') == 'first'
+    assert plaintexts.get('c', 'token') == 'third'
+    assert plaintexts.stats()['evictions'] == 1
+
+
+def test_evicted_and_cleared_values_are_wiped():
+    plaintexts = PlaintextCache(maxsize=1, ttl=60)
+    plaintexts.put('a', 'token', 'secret')
+    evicted = plaintexts.items['a'][1]
+    plaintexts.put('b', 'token', 'other')
+    assert evicted == bytearray(len('secret'))
+
+    cleared = plaintexts.items['b'][1]
+    plaintexts.clear()
+    assert cleared == bytearray(len('other'))
+    assert len(plaintexts) == 0
+
+
+def test_disabled_cache_stores_nothing():
+    plaintexts = PlaintextCache(maxsize=0)
+    plaintexts.put('a', 'token', 'secret')
+
+    assert plaintexts.get('a', 'token') is None
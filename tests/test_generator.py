@@ -0,0 +1,96 @@
+import string
+from collections import Counter
+
+import pytest
+
+import generator
+from generator import PasswordPolicy, generate_many, random_characters, random_indices
+
+
+def feed(monkeypatch, *blocks):
+    # secrets.token_bytes returning the given blocks in turn, padded to the size asked for.
+    blocks = list(blocks)
+
+    def token_bytes(size):
+        block = blocks.pop(0)
+        return block + bytes(size - len(block)) if len(block) < size else block[:size]
+
+    monkeypatch.setattr(generator.secrets, 'token_bytes', token_bytes)
+
+
+def test_random_indices_rejects_biased_values(monkeypatch):
+    # For 100 values only bytes below 200 are accepted, 200 and above would favour 0 to 55.
+    feed(monkeypatch, bytes([250, 199, 200, 57, 255, 100]))
+
+    assert random_indices(3, 100) == [99, 57, 0]
+
+
+def test_random_indices_wide_values(monkeypatch):
+    # 1000 values need 2 bytes, 65000 and above are rejected.
+    feed(monkeypatch, (65000).to_bytes(2, 'big') + (1999).to_bytes(2, 'big') + (7).to_bytes(2, 'big'))
+
+    assert random_indices(2, 1000) == [999, 7]
+
+
+def test_random_indices_cover_the_range():
+    values = Counter(random_indices(30000, 3))
+
+    assert set(values) == {0, 1, 2}
+    assert all(9000 < count < 11000 for count in values.values())
+
+
+def test_random_characters_rejects_biased_bytes(monkeypatch):
+    # For 3 characters byte 255 is rejected, it would favour 'a'.
+    feed(monkeypatch, bytes([255, 1, 255, 5]) + bytes([255] * 60), bytes([3]))
+
+    assert random_characters(3, 'abc') == 'bca'
+
+
+def test_random_characters_stay_in_alphabet():
+    password = random_characters(5000, 'xyz')
+
+    assert len(password) == 5000 and set(password) == set('xyz')
+
+
+def test_passwords_hold_every_required_class():
+    policy = PasswordPolicy(length=4)
+
+    for password in generate_many(500, policy):
+        assert len(password) == 4
+        for chars in generator.CLASSES.values():
+            assert set(password) & set(chars)
+
+
+def test_excluded_characters_never_appear():
+    policy = PasswordPolicy(length=16, exclude_ambiguous=True, exclude='abc$')
+    excluded = set(generator.AMBIGUOUS) | set('abc$')
+
+    for password in generate_many(500, policy):
+        assert not set(password) & excluded
+
+
+def test_disabled_classes_never_appear():
+    policy = PasswordPolicy(length=12, uppercase=False, symbols=False)
+
+    for password in generate_many(200, policy):
+        assert set(password) <= set(string.ascii_lowercase + string.digits)
+        assert set(password) & set(string.digits)
+
+
+def test_impossible_policies_are_rejected():
+    with pytest.raises(ValueError):
+        PasswordPolicy(lowercase=False, uppercase=False, digits=False, symbols=False).classes()
+    with pytest.raises(ValueError):
+        PasswordPolicy(length=3).classes()
+    with pytest.raises(ValueError):
+        PasswordPolicy(digits=False, symbols=False, uppercase=False, exclude=string.ascii_lowercase).classes()
+
+
+def test_passphrases_from_diceware_wordlist(tmp_path):
+    wordlist = tmp_path / 'words.txt'
+    wordlist.write_text('11111 apple\n11112 banana\n\n11113 cherry\n')
+    policy = PasswordPolicy(passphrase=True, words=4, separator='.', wordlist=str(wordlist))
+
+    for passphrase in generate_many(50, policy):
+        words = passphrase.split('.')
+        assert len(words) == 4 and set(words) <= {'apple', 'banana', 'cherry'}
@@ -0,0 +1,22 @@
+from entries import Entry, EntryStore
+from search import Query
+
+
+def keys(entries):
+    return [(entry.website, entry.username) for entry in entries]
+
+
+def test_batch_with_repeated_key_is_indexed_once():
+    store = EntryStore([Entry('a.com', 'u', 'p', 1, 1)])
+    list(store.search(Query(created=(0, None))))
+    for size in (0, 100):
+        # Small batches are inserted in place, big ones appended and sorted.
+        filler = [Entry('c{}.com'.format(i), 'x', 'p', 3, 3) for i in range(size)]
+        store.add_many([Entry('b.com', 'v', 'p', 5, 5)] + filler + [Entry('b.com', 'v', 'p', 6, 6)])
+
+        assert keys(store.search(Query(created=(0, None)))).count(('b.com', 'v')) == 1
+        assert keys(store.search(Query(modified=(6, 7)))) == [('b.com', 'v')]
+
+        store.remove('b.com', 'v')
+        assert [item for item in store.index.created + store.index.modified if item[1] == ('b.com', 'v')] == []
+        assert keys(store.search(Query('b.com'))) == []
@@ -0,0 +1,308 @@
+import os
+import json
+import sqlite3
+import contextlib
+import io
+
+import pytest
+
+import cli
+import masterkey
+import vaultfile
+from entries import Entry
+
+ENTRIES = [('site{}.example.com'.format(i % 3), 'user{}'.format(i), 'password{}'.format(i)) for i in range(7)]
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def filled(make_manager):
+    manager = make_manager()
+    manager.add_passwords(ENTRIES)
+    return manager
+
+
+def passwords(manager):
+    return {(website, username): manager.get_password(website, username) for website, username, password in ENTRIES}
+
+
+def expected():
+    return {(website, username): password for website, username, password in ENTRIES}
+
+
+def keys(manager):
+    return masterkey.read_keys(manager.config.master_key_filepath)
+
+
+def run_cli(capsys, config_file, *argv):
+    code = cli.main(['--config', config_file] + list(argv))
+    out, err = capsys.readouterr()
+    return code, [json.loads(line) for line in out.splitlines()]
+
+
+def test_rotate_reencrypts_vaults_and_retires_old_key(make_manager, tmp_path):
+    manager = filled(make_manager)
+    db_path = os.path.join(manager.config.default_db_dir, 'out.db')
+    sqlite3.connect(db_path).close()
+    quiet(manager.save_to_file, 'vault.ndjson')
+    quiet(manager.export_to_database, db_path)
+    binary_path = str(tmp_path / 'out.pmv')
+    manager.export_to_binary(binary_path)
+    old_keys = keys(manager)
+
+    quiet(manager.rotate_key, [binary_path], progress=False)
+
+    assert len(keys(manager)) == 1 and keys(manager) != old_keys
+    assert masterkey.read_keys(manager.config.retired_keys_filepath) == old_keys
+    assert not os.path.exists(manager.config.key_rotation_state_path)
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert passwords(reader) == expected()
+    reader = make_manager()
+    quiet(reader.load_from_database, db_path)
+    assert passwords(reader) == expected()
+    reader = make_manager()
+    reader.load_from_binary(binary_path)
+    assert passwords(reader) == expected()
+
+
+def test_rotate_with_vault_keeps_default_vault_readable(config_file, capsys, tmp_path):
+    # One key file serves every vault, rotating one vault re-encrypts the others found by default.
+    run_cli(capsys, config_file, 'add', 'a.com', 'alice', '--password', 'secret')
+    databases = tmp_path / 'Database' / 'db' / 'Passwords'
+    exported = str(databases / 'out.db')
+    run_cli(capsys, config_file, 'export', exported)
+    live = str(databases / 'live.db')
+    run_cli(capsys, config_file, '--vault', live, 'add', 'b.com', 'bob', '--password', 'hunter2')
+
+    code, [result] = run_cli(capsys, config_file, '--vault', live, 'rotate-key')
+    assert code == 0 and result['retired']
+
+    code, [entry] = run_cli(capsys, config_file, 'get', 'a.com', 'alice')
+    assert entry['password'] == 'secret'
+    code, [entry] = run_cli(capsys, config_file, '--vault', live, 'get', 'b.com', 'bob')
+    assert entry['password'] == 'hunter2'
+    code, [entry] = run_cli(capsys, config_file, '--vault', exported, 'get', 'a.com', 'alice')
+    assert entry['password'] == 'secret'
+
+
+def test_keep_old_key_does_not_stop_later_rotations(make_manager):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    first = keys(manager)
+
+    quiet(manager.rotate_key, retire=False, progress=False)
+    second = keys(manager)
+    assert second[1:] == first and not os.path.exists(manager.config.key_rotation_state_path)
+
+    quiet(manager.rotate_key, retire=False, progress=False)
+    third = keys(manager)
+    assert third[1:] == second
+
+    quiet(manager.rotate_key, progress=False)
+    assert len(keys(manager)) == 1 and keys(manager)[0] not in third
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert passwords(reader) == expected()
+
+
+def test_interrupted_rotation_resumes(make_manager, monkeypatch):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    vault = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    rotate_entries = masterkey._rotate_entries
+    calls = []
+
+    def interrupted(manager, entries):
+        calls.append(len(entries))
+        # The entries in memory take the first batches, the file the ones after.
+        if len(calls) == 6:
+            raise KeyboardInterrupt
+        return rotate_entries(manager, entries)
+
+    monkeypatch.setattr(masterkey, '_rotate_entries', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        quiet(manager.rotate_key, progress=False)
+    monkeypatch.setattr(masterkey, '_rotate_entries', rotate_entries)
+    state = masterkey.load_state(manager.config.key_rotation_state_path)
+    assert state['vaults'][vault]['records'] == 2
+    new_key = keys(manager)[0]
+
+    reader = make_manager()
+    quiet(reader.rotate_key, progress=False)
+
+    assert keys(reader) == [new_key]
+    assert not os.path.exists(reader.config.key_rotation_state_path)
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert passwords(reader) == expected()
+
+
+def test_rotation_keeps_tombstones(make_manager, tmp_path):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    source = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    db_path = str(tmp_path / 'out.db')
+    quiet(manager.convert_vault, source, db_path)
+    manager.delete_password('site1.example.com', 'user1')
+    quiet(manager.save_to_file, 'vault.ndjson')
+
+    quiet(manager.rotate_key, progress=False)
+    quiet(make_manager().convert_vault, source, db_path)
+
+    rows = sqlite3.connect(db_path).execute('SELECT website, username FROM passwords').fetchall()
+    assert ('site1.example.com', 'user1') not in rows
+    assert len(rows) == len(ENTRIES) - 1
+
+
+def test_failed_vault_does_not_stop_rotation(make_manager):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    quiet(manager.save_to_file, 'broken.ndjson')
+    broken = os.path.join(manager.config.save_password_dir, 'broken.ndjson')
+    # The first record decrypts, a later one does not.
+    vaultfile.append_records(broken, [Entry('bad.example.com', 'someone', 'not a token', 1, 1)])
+    old_keys = keys(manager)
+
+    with pytest.raises(ValueError):
+        quiet(manager.rotate_key, progress=False)
+
+    assert keys(manager)[1:] == old_keys
+    state = masterkey.load_state(manager.config.key_rotation_state_path)
+    assert not state['vaults'][broken].get('finished')
+    assert state['vaults'][os.path.join(manager.config.save_password_dir, 'vault.ndjson')]['finished']
+
+    os.remove(broken)
+    quiet(manager.rotate_key, progress=False)
+    assert len(keys(manager)) == 1 and keys(manager)[0] not in old_keys
+    assert not os.path.exists(manager.config.key_rotation_state_path)
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert passwords(reader) == expected()
+
+
+def test_delta_save_appends_changes(make_manager):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    path = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    with open(path) as f:
+        lines = len(f.readlines())
+
+    manager.modify_password('site0.example.com', 'user0', 'changed')
+    manager.delete_password('site1.example.com', 'user1')
+    manager.add_passwords([('new.example.com', 'someone', 'added')])
+    quiet(manager.save_to_file, 'vault.ndjson')
+
+    # The three changed records, after the line framing the batch.
+    with open(path) as f:
+        assert len(f.readlines()) == lines + 4
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert reader.passwords.get('site1.example.com', 'user1') is None
+    assert reader.get_password('site0.example.com', 'user0') == 'changed'
+    assert reader.get_password('new.example.com', 'someone') == 'added'
+    assert len(reader.passwords) == len(ENTRIES)
+
+
+def test_vault_file_is_compacted(make_manager):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    path = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    sizes = []
+    for i in range(6):
+        # A fresh manager each time, which counts the records of the file as it loads it.
+        manager = make_manager()
+        quiet(manager.load_from_file, 'vault.ndjson')
+        manager.modify_password('site0.example.com', 'user0', 'changed{}'.format(i))
+        manager.modify_password('site1.example.com', 'user1', 'changed{}'.format(i))
+        quiet(manager.save_to_file, 'vault.ndjson')
+        with open(path) as f:
+            sizes.append(len(f.readlines()))
+
+    # Appended three times, then rewritten once the superseded records pass half of the file.
+    assert sizes == [11, 14, 17, 8, 11, 14]
+    reader = make_manager()
+    quiet(reader.load_from_file, 'vault.ndjson')
+    assert reader.get_password('site0.example.com', 'user0') == 'changed5'
+    assert len(reader.passwords) == len(ENTRIES)
+
+
+def test_database_export_round_trip_with_deletions(make_manager, tmp_path):
+    manager = filled(make_manager)
+    db_path = str(tmp_path / 'out.db')
+    sqlite3.connect(db_path).close()
+    assert quiet(manager.export_to_database, db_path) == (len(ENTRIES), 0)
+
+    manager.delete_password('site1.example.com', 'user1')
+    manager.modify_password('site0.example.com', 'user0', 'changed')
+    assert quiet(manager.export_to_database, db_path) == (0, 1)
+
+    reader = make_manager()
+    quiet(reader.load_from_database, db_path)
+    assert reader.passwords.get('site1.example.com', 'user1') is None
+    assert reader.get_password('site0.example.com', 'user0') == 'changed'
+    assert len(reader.passwords) == len(ENTRIES) - 1
+
+
+def test_convert_carries_deletions_into_database(make_manager, tmp_path):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    source = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    db_path = str(tmp_path / 'out.db')
+    quiet(manager.convert_vault, source, db_path)
+
+    manager.delete_password('site1.example.com', 'user1')
+    quiet(manager.save_to_file, 'vault.ndjson')
+    assert any(entry.deleted for entry in vaultfile.read_records(source, tombstones=True))
+    quiet(make_manager().convert_vault, source, db_path)
+
+    rows = sqlite3.connect(db_path).execute('SELECT website, username FROM passwords').fetchall()
+    assert ('site1.example.com', 'user1') not in rows
+    assert len(rows) == len(ENTRIES) - 1
+
+
+def test_merge_keeps_newer_side(make_manager):
+    manager = filled(make_manager)
+    quiet(manager.save_to_file, 'vault.ndjson')
+    other = make_manager()
+    quiet(other.load_from_file, 'vault.ndjson')
+    other.modify_password('site2.example.com', 'user2', 'newer')
+    entry = other.passwords.get('site2.example.com', 'user2')
+    entry.modified += 10
+    other.passwords.add(entry)
+    older = manager.passwords.get('site0.example.com', 'user0')
+
+    kept = manager.merge(list(other.passwords))
+
+    assert manager.get_password('site2.example.com', 'user2') == 'newer'
+    assert manager.passwords.get('site0.example.com', 'user0').modified == older.modified
+    assert kept == []
+
+
+def test_cli_get_picks_record_modified_last(config_file, capsys, make_manager):
+    run_cli(capsys, config_file, 'add', 'a.com', 'alice', '--password', 'newer')
+    run_cli(capsys, config_file, 'add', 'b.com', 'bob', '--password', 'gone')
+    run_cli(capsys, config_file, 'rm', 'b.com', 'bob')
+    manager = make_manager()
+    path = os.path.join(manager.config.save_password_dir, 'vault.ndjson')
+    # A record merged in from an older copy of the vault, appended after the newer one.
+    quiet(manager.load_from_file, 'vault.ndjson')
+    entry = manager.passwords.get('a.com', 'alice')
+    entry.password = manager.encrypt_password('older')
+    entry.modified -= 10
+    vaultfile.append_records(path, [entry])
+
+    code, [found] = run_cli(capsys, config_file, 'get', 'a.com', 'alice')
+    assert found['password'] == 'newer'
+    code, output = run_cli(capsys, config_file, 'get', 'b.com', 'bob')
+    assert code == 1 and output == []
+
+
+def test_cli_export_without_vault_fails(config_file, capsys, tmp_path):
+    code, output = run_cli(capsys, config_file, 'export', str(tmp_path / 'out.ndjson'))
+
+    assert code == 1 and output == []
+    assert not os.path.exists(str(tmp_path / 'out.ndjson'))
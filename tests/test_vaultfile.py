@@ -0,0 +1,82 @@
+import os
+import json
+
+import pytest
+
+import vaultfile
+from entries import Entry, Tombstone
+
+
+def entry(i, password='password', modified=100):
+    return Entry('site{}.example.com'.format(i), 'user{}'.format(i), password, 100, modified)
+
+
+def read(path):
+    return {(record.website, record.username): record.password for record in vaultfile.read_records(path)}
+
+
+@pytest.fixture
+def appended(tmp_path):
+    # A vault file of five entries with one batch appended: a change and a deletion.
+    path = str(tmp_path / 'vault.ndjson')
+    vaultfile.write_records(path, [entry(i) for i in range(5)])
+    vaultfile.append_records(path, [entry(0, 'changed', 200), Tombstone('site1.example.com', 'user1', 200)])
+    return path
+
+
+def test_appended_batch_is_framed(appended):
+    with open(appended) as f:
+        lines = f.readlines()
+    marker = json.loads(lines[-3])
+    assert marker['append'] == 2
+    assert read(appended)[('site0.example.com', 'user0')] == 'changed'
+    assert ('site1.example.com', 'user1') not in read(appended)
+
+
+@pytest.mark.parametrize('cut', [1, 20, 60])
+def test_truncated_append_is_skipped(appended, cut, capsys):
+    # A crash during the append leaves it cut short, the file reads as before it.
+    size = os.path.getsize(appended)
+    with open(appended, 'r+') as f:
+        f.truncate(size - cut)
+
+    records = read(appended)
+
+    assert records[('site0.example.com', 'user0')] == 'password'
+    assert ('site1.example.com', 'user1') in records
+    assert len(records) == 5
+    assert 'incomplete' in capsys.readouterr().out
+
+
+def test_append_after_truncated_append(appended):
+    with open(appended, 'r+') as f:
+        f.truncate(os.path.getsize(appended) - 20)
+    vaultfile.append_records(appended, [entry(7)])
+
+    records = read(appended)
+
+    assert ('site7.example.com', 'user7') in records
+    assert records[('site0.example.com', 'user0')] == 'password'
+    assert len(records) == 6
+
+
+def test_corrupted_append_is_skipped(appended):
+    with open(appended) as f:
+        text = f.read()
+    with open(appended, 'w') as f:
+        f.write(text.replace('changed', 'chanGed'))
+
+    assert read(appended)[('site0.example.com', 'user0')] == 'password'
+
+
+def test_version_2_files_are_read_and_torn_last_line_skipped(tmp_path):
+    path = str(tmp_path / 'old.ndjson')
+    with open(path, 'w') as f:
+        f.write(json.dumps({'format': vaultfile.FORMAT, 'version': 2}) + '\n')
+        for i in range(3):
+            f.write(vaultfile.format_record(entry(i)))
+        f.write(vaultfile.format_record(entry(3))[:-10])
+
+    assert len(read(path)) == 3
+    with pytest.raises(ValueError):
+        vaultfile.append_records(path, [entry(4)])
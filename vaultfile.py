@@ -0,0 +1,263 @@
+import os
+import json
+import zlib
+import contextlib
+
+import metrics
+from entries import Entry, Tombstone, parse_date
+
+# Vault files are NDJSON: a header record followed by one JSON record per line.
+# Later records replace earlier ones with the same (website, username), which
+# is what lets new records be appended without rewriting the file. A deleted
+# entry is appended as a tombstone record, {"website": ..., "username": ...,
+# "date_modified": <time of deletion>, "deleted": true}. Version 2 added tombstones.
+#
+# Version 3 frames appends, the only writes not made atomic by a rename: each
+# appended batch starts with an {"append": <number of records>, "crc32": <checksum
+# of their lines>} line. A crash during an append leaves a last line without its
+# newline, or a batch cut short, and readers skip both, see _committed.
+FORMAT = 'passmanager-ndjson'
+VERSION = 3
+# Appended batches start with this, records with their website.
+APPEND_MARKER = '{"append"'
+FIELDS = ('website', 'username', 'password', 'date_created', 'date_modified')
+# Called through these names so that metrics can time them.
+dumps = json.dumps
+loads = json.loads
+
+
+def header():
+    return {'format': FORMAT, 'version': VERSION}
+
+
+def format_record(entry):
+    # One line of a vault file, for an Entry or a Tombstone.
+    return dumps(entry.record()) + '\n'
+
+
+def _lines(records):
+    yield dumps(header()) + '\n'
+    for record in records:
+        yield format_record(record)
+
+
+def fsync_dir(directory):
+    # Makes the rename itself durable, not supported on every platform.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_open(filepath, mode='w'):
+    # Write to a temp file next to `filepath`, fsync it and rename it into place,
+    # so a crash leaves either the old or the new file, never a truncated one.
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_path = tempfile.mkstemp(prefix='.vault-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    fsync_dir(directory)
+
+
+def load_state(filepath):
+    # JSON state kept between runs, such as audit results or rotation checkpoints, {} when there is none.
+    if os.path.exists(filepath):
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(filepath, state):
+    with atomic_open(filepath) as f:
+        json.dump(state, f)
+
+
+def write_records(filepath, records):
+    # Stream records into a new vault file that atomically replaces `filepath`.
+    with atomic_open(filepath) as f:
+        f.writelines(_lines(records))
+        metrics.count('bytes.written', f.tell())
+
+
+def _truncate_partial_line(f):
+    # Cut a last line left without its newline by a crash, f is opened 'rb+'.
+    end = f.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        start = max(0, position - 65536)
+        f.seek(start)
+        block = f.read(position - start)
+        if position == end and block.endswith(b'\n'):
+            return
+        newline = block.rfind(b'\n')
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            return
+        position = start
+    f.truncate(0)
+
+
+def append_records(filepath, records):
+    # Add records to the end of an existing vault file, or create it. The records
+    # are written as one batch, framed with their count and checksum.
+    if not os.path.exists(filepath):
+        return write_records(filepath, records)
+    if version(filepath) != VERSION:
+        raise ValueError("{} was written by an older version and cannot be appended to".format(filepath))
+    data = [format_record(record) for record in records]
+    if not data:
+        return
+    data = ''.join(data).encode()
+    marker = dumps({'append': data.count(b'\n'), 'crc32': zlib.crc32(data)}) + '\n'
+    with open(filepath, 'rb+') as f:
+        _truncate_partial_line(f)
+        start = f.seek(0, os.SEEK_END)
+        f.write(marker.encode() + data)
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.count('bytes.written', f.tell() - start)
+
+
+def _read_header(f):
+    line = f.readline()
+    try:
+        record = loads(line)
+    except ValueError:
+        return None
+    if isinstance(record, dict) and record.get('format') == FORMAT:
+        return record
+    return None
+
+
+def _entry(record, wrapped):
+    if record.get('deleted'):
+        return Tombstone(record['website'], record['username'], parse_date(record['date_modified']))
+    return Entry.from_record(record, wrapped)
+
+
+def version(filepath):
+    # Format version of a vault file, None for a legacy JSON vault.
+    with open(filepath, 'r') as f:
+        found = _read_header(f)
+    return None if found is None else found['version']
+
+
+def is_ndjson(filepath):
+    return version(filepath) is not None
+
+
+def _committed(f, filepath=None):
+    # The record lines that were written completely. A last line without its newline,
+    # and an appended batch with fewer lines than its marker says or a wrong checksum,
+    # were cut short by a crash and are skipped, with a warning when filepath is given.
+    batch = None
+    torn = False
+    for line in f:
+        if not line.endswith('\n'):
+            torn = True
+            break
+        if line.startswith(APPEND_MARKER):
+            # A batch still open here was cut short.
+            torn = torn or batch is not None
+            marker = loads(line)
+            batch, count, checksum = [], marker['append'], marker['crc32']
+        elif batch is None:
+            if line.strip():
+                yield line
+        else:
+            batch.append(line)
+            if len(batch) == count:
+                if zlib.crc32(''.join(batch).encode()) == checksum:
+                    yield from batch
+                else:
+                    torn = True
+                batch = None
+    if (torn or batch is not None) and filepath is not None:
+        print("Warning: skipped records of {} that an interrupted save left incomplete".format(filepath))
+
+
+def _deleted_lines(f):
+    # Line number and tombstone of the last deletion of each deleted key, read in a
+    # cheap pass that only parses lines that can be tombstones.
+    deleted = {}
+    for number, line in enumerate(_committed(f)):
+        if '"deleted"' in line:
+            record = loads(line)
+            if record.get('deleted'):
+                deleted[(record['website'], record['username'])] = number, _entry(record, False)
+    return deleted
+
+
+def read_records(filepath, tombstones=False, deleted=None):
+    # Lazily yield the entries of a vault file.
+    # Legacy .json vaults (one JSON array) are still read, in one go, and their
+    # entries are flagged wrapped since they carry an extra encryption layer.
+    # Tombstones are yielded as they are with tombstones=True, for merging. Otherwise
+    # deleted entries are left out, which takes a first pass over the file, and a
+    # `deleted` dict is filled with the tombstones of the entries left out once the
+    # last record is read.
+    with open(filepath, 'r') as f:
+        metrics.count('bytes.read', os.fstat(f.fileno()).st_size)
+        found = _read_header(f)
+        if found is None:
+            f.seek(0)
+            for record in json.load(f):
+                yield _entry(record, True)
+            return
+        if found['version'] > VERSION:
+            raise ValueError("Unsupported vault file version: {}".format(found['version']))
+        lines = None
+        if not tombstones:
+            start = f.tell()
+            lines = _deleted_lines(f)
+            f.seek(start)
+        restored = set()
+        for number, line in enumerate(_committed(f, filepath)):
+            record = _entry(loads(line), False)
+            if lines:
+                if record.deleted:
+                    continue
+                key = (record.website, record.username)
+                if key in lines:
+                    if lines[key][0] > number:
+                        continue
+                    # Added again after it was deleted.
+                    restored.add(key)
+            yield record
+        if lines and deleted is not None:
+            deleted.update((key, tombstone) for key, (number, tombstone) in lines.items() if key not in restored)
+
+
+def find_records(filepath, website, username):
+    # The records of one key in file order, tombstones included, in a single pass
+    # that only parses the lines holding the website.
+    with open(filepath, 'r') as f:
+        metrics.count('bytes.read', os.fstat(f.fileno()).st_size)
+        found = _read_header(f)
+        if found is None:
+            # A legacy JSON vault is read in one go anyway.
+            yield from (record for record in read_records(filepath) if (record.website, record.username) == (website, username))
+            return
+        if found['version'] > VERSION:
+            raise ValueError("Unsupported vault file version: {}".format(found['version']))
+        text = dumps(website)
+        for line in _committed(f, filepath):
+            if text in line:
+                record = loads(line)
+                if record['website'] == website and record['username'] == username:
+                    yield _entry(record, False)